@@ -0,0 +1,366 @@
+import csv
+import io
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import List, Tuple
+import business_time
+import models
+from cache import result_cache_from_env
+
+# Window shown on the analytics page and in the exports unless ?range= is given
+DEFAULT_RANGE = '7d'
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# Longest selectable range, and most buckets returned; a finer granularity
+# that would exceed MAX_POINTS is coarsened
+MAX_RANGE_DAYS = int(os.environ.get("ANALYTICS_MAX_RANGE_DAYS", 731))
+MAX_POINTS = int(os.environ.get("ANALYTICS_MAX_POINTS", 120))
+
+# Read analytics from the rollup tables (migration 4) instead of scanning appointments
+USE_ROLLUP = os.environ.get("ANALYTICS_USE_ROLLUP", "true").lower() in ("1", "true", "yes")
+
+# Serve results stored by the nightly precompute batch (precompute.py) while they are current
+USE_PRECOMPUTED = os.environ.get("ANALYTICS_USE_PRECOMPUTED", "true").lower() in ("1", "true", "yes")
+
+# Seconds between checks for newly inserted appointments
+WATERMARK_CHECK_INTERVAL = float(os.environ.get("ANALYTICS_CACHE_CHECK_INTERVAL", 5))
+
+
+class InvalidWindow(ValueError):
+    """Raised for a ?range= or ?granularity= that cannot be served"""
+
+
+def truncate(day, granularity):
+    """First day of the bucket containing ``day``, as date_trunc() computes it (weeks start Monday)"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day, granularity):
+    if granularity == 'week':
+        return day + timedelta(days=7)
+    if granularity == 'month':
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _months_back(day, months):
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+@dataclass(frozen=True)
+class Window:
+    """Trailing time range ending today, split into day, week or month buckets.
+
+    ``first_day`` is aligned to the start of its bucket, so every bucket but
+    the current one is complete.
+    """
+    range: str
+    granularity: str
+    first_day: date
+    last_day: date
+
+    @property
+    def buckets(self):
+        buckets = []
+        day = self.first_day
+        while day <= self.last_day:
+            buckets.append(day)
+            day = next_bucket(day, self.granularity)
+        return buckets
+
+    @property
+    def label(self):
+        count, unit = int(self.range[:-1]), {'d': 'day', 'w': 'week', 'm': 'month'}[self.range[-1]]
+        return f"last {count} {unit}{'s' if count != 1 else ''} by {self.granularity}"
+
+
+def resolve_window(range_value=None, granularity=None, today=None):
+    """Window for a ``range`` such as ``7d``, ``12w`` or ``12m`` and an optional granularity.
+
+    Without a granularity, ranges up to a month are shown by day, up to half
+    a year by week and longer ones by month.
+    """
+    range_value = (range_value or DEFAULT_RANGE).strip().lower()
+    today = today or business_time.today()
+    try:
+        count, unit = int(range_value[:-1]), range_value[-1]
+    except (ValueError, IndexError):
+        raise InvalidWindow(f"invalid range {range_value!r}; use e.g. 7d, 12w or 12m")
+    if count < 1 or unit not in 'dwm':
+        raise InvalidWindow(f"invalid range {range_value!r}; use e.g. 7d, 12w or 12m")
+
+    too_long = InvalidWindow(f"range {range_value!r} is longer than {MAX_RANGE_DAYS} days")
+    try:
+        if unit == 'm':
+            start = _months_back(today, count - 1)
+        else:
+            start = today - timedelta(days=count * (7 if unit == 'w' else 1) - 1)
+    except (OverflowError, ValueError):
+        # Before year 1, or beyond what timedelta holds
+        raise too_long
+    if (today - start).days + 1 > MAX_RANGE_DAYS:
+        raise too_long
+
+    if granularity:
+        if granularity not in GRANULARITIES:
+            raise InvalidWindow(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    else:
+        span = (today - start).days + 1
+        granularity = 'day' if span <= 31 else 'week' if span <= 183 else 'month'
+
+    for candidate in GRANULARITIES[GRANULARITIES.index(granularity):]:
+        window = Window(range_value, candidate, truncate(start, candidate), today)
+        if len(window.buckets) <= MAX_POINTS:
+            return window
+    raise InvalidWindow(f"range {range_value!r} needs more than {MAX_POINTS} points")
+
+
+@dataclass(frozen=True)
+class AnalyticsResult:
+    """Aggregates for one (location, expertise) pair"""
+    window: Window
+    total_count: int = 0
+    series: List[Tuple[date, int]] = field(default_factory=list)
+    issues: List[Tuple[str, int]] = field(default_factory=list)
+
+    @property
+    def dates(self):
+        return [day.strftime('%Y-%m-%d') for day, _ in self.series]
+
+    @property
+    def counts(self):
+        return [count for _, count in self.series]
+
+    @property
+    def busiest(self):
+        """(bucket start, count) with the most appointments, or None if all are empty"""
+        bucket = max(self.series, key=lambda item: item[1], default=None)
+        return bucket if bucket and bucket[1] else None
+
+    @property
+    def issue_names(self):
+        return [intent for intent, _ in self.issues]
+
+    @property
+    def issue_counts(self):
+        return [count for _, count in self.issues]
+
+    def top_issues(self, limit):
+        return self.issues[:limit]
+
+    def to_dict(self):
+        """Shape used by analytics.html, charts.js and /export/chart-data"""
+        busiest = self.busiest
+        return {
+            'total_count': self.total_count,
+            'range': self.window.range,
+            'granularity': self.window.granularity,
+            'window_label': self.window.label,
+            'dates': self.dates,
+            'daily_counts': self.counts,
+            'busiest': [busiest[0].strftime('%Y-%m-%d'), busiest[1]] if busiest else None,
+            'issues': self.issue_names,
+            'issue_counts': self.issue_counts
+        }
+
+    def to_json(self):
+        """Serialized aggregates; the window is stored alongside, not in here"""
+        return json.dumps({
+            'total_count': self.total_count,
+            'series': [[day.isoformat(), count] for day, count in self.series],
+            'issues': [list(issue) for issue in self.issues],
+        })
+
+    @classmethod
+    def from_json(cls, window, data):
+        data = json.loads(data)
+        return cls(
+            window=window,
+            total_count=data['total_count'],
+            series=[(date.fromisoformat(day), count) for day, count in data['series']],
+            issues=[(intent, count) for intent, count in data['issues']],
+        )
+
+
+def report_csv(result):
+    """Data sections of the analytics CSV report; the export route prepends the header"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    window = result.window
+
+    # Write appointments per bucket section
+    writer.writerow([f"Appointments per {window.granularity.capitalize()} ({window.label.capitalize()})"])
+    writer.writerow(['Date' if window.granularity == 'day' else f"{window.granularity.capitalize()} Starting",
+                     'Number of Appointments'])
+    for day, count in result.series:
+        writer.writerow([day.strftime('%Y-%m-%d'), count])
+    writer.writerow([])
+
+    # Write issue types section
+    writer.writerow(['Issue Types Distribution'])
+    writer.writerow(['Issue Type', 'Number of Appointments'])
+    for intent, count in result.issues:
+        writer.writerow([intent, count])
+    return output.getvalue()
+
+
+# One scan of the matching appointments produces the grand total, the
+# per-intent counts and the per-bucket counts for the trailing window.
+# Rows outside the half-open window fall into a NULL bucket, which is
+# skipped.  Buckets are calendar days, ISO weeks or months in the business
+# timezone, truncated with date_trunc().
+ANALYTICS_QUERY = """
+    SELECT intent, day, COUNT(*) AS count,
+           GROUPING(intent) AS all_intents, GROUPING(day) AS all_days
+    FROM (
+        SELECT intent,
+               CASE WHEN created_at >= %(start)s AND created_at < %(end)s
+                    THEN date_trunc(%(granularity)s,
+                                    created_at AT TIME ZONE %(storage_tz)s AT TIME ZONE %(business_tz)s)::date
+               END AS day
+        FROM appointments
+        WHERE location = %(location)s
+        AND intent LIKE %(intent)s
+    ) matched
+    GROUP BY GROUPING SETS ((), (intent), (day))
+"""
+
+
+# Same result shape as ANALYTICS_QUERY, read from the trigger-maintained
+# rollup tables (see rollup.py), so the cost depends on the number of
+# intents and days covered rather than on the number of appointments.
+ROLLUP_ANALYTICS_QUERY = """
+    WITH totals AS (
+        SELECT intent, count
+        FROM appointment_intent_totals
+        WHERE location = %(location)s
+        AND intent LIKE %(intent)s
+        AND count > 0
+    )
+    SELECT NULL AS intent, NULL::date AS day, COALESCE(SUM(count), 0) AS count,
+           1 AS all_intents, 1 AS all_days
+    FROM totals
+    UNION ALL
+    SELECT intent, NULL, count, 0, 1
+    FROM totals
+    UNION ALL
+    SELECT NULL, date_trunc(%(granularity)s, day)::date, SUM(count), 1, 0
+    FROM appointment_daily_rollup
+    WHERE location = %(location)s
+    AND day >= %(first_day)s AND day <= %(last_day)s
+    AND intent LIKE %(intent)s
+    GROUP BY 2
+    HAVING SUM(count) > 0
+"""
+
+
+def compute_analytics(conn, location, expertise, window=None):
+    """Compute all analytics aggregates in a single database round trip.
+
+    Buckets of ``window`` without appointments are filled in with zero.
+    """
+    window = window or resolve_window()
+    cur = conn.cursor()
+    if USE_ROLLUP:
+        cur.execute(ROLLUP_ANALYTICS_QUERY, {
+            'granularity': window.granularity,
+            'first_day': window.first_day,
+            'last_day': window.last_day,
+            'location': location,
+            'intent': f"%{expertise}%",
+        })
+    else:
+        cur.execute(ANALYTICS_QUERY, {
+            'granularity': window.granularity,
+            'start': business_time.day_start(window.first_day),
+            'end': business_time.day_start(window.last_day + timedelta(days=1)),
+            'storage_tz': business_time.STORAGE_TIMEZONE.key,
+            'business_tz': business_time.BUSINESS_TIMEZONE.key,
+            'location': location,
+            'intent': f"%{expertise}%",
+        })
+    rows = cur.fetchall()
+    cur.close()
+
+    total_count = 0
+    bucket_counts = {}
+    issues = []
+    for intent, day, count, all_intents, all_days in rows:
+        if all_intents and all_days:
+            total_count = count
+        elif all_days:
+            issues.append((intent, count))
+        elif day is not None:
+            bucket_counts[day] = count
+
+    series = [(bucket, bucket_counts.get(bucket, 0)) for bucket in window.buckets]
+    issues.sort(key=lambda item: (-item[1], item[0]))
+    return AnalyticsResult(window=window, total_count=total_count, series=series, issues=issues)
+
+
+# Shared by every technician with the same (location, expertise, window)
+analytics_cache = result_cache_from_env('ANALYTICS')
+
+_watermark = None
+_watermark_checked_at = 0.0
+_watermark_lock = threading.Lock()
+
+
+def appointments_watermark(conn):
+    """Return the newest appointment id, re-read at most every WATERMARK_CHECK_INTERVAL.
+
+    The id follows insertion order, so it also moves for backfilled rows
+    whose created_at lies in the past.  The lookup walks the primary key
+    index for a single row.
+    """
+    global _watermark, _watermark_checked_at
+    now = time.monotonic()
+    if _watermark is not None and now - _watermark_checked_at < WATERMARK_CHECK_INTERVAL:
+        return _watermark
+    with _watermark_lock:
+        if _watermark is None or now - _watermark_checked_at >= WATERMARK_CHECK_INTERVAL:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM appointments ORDER BY id DESC LIMIT 1")
+            row = cur.fetchone()
+            cur.close()
+            _watermark = row[0] if row else 0
+            _watermark_checked_at = now
+    return _watermark
+
+
+def stored_artifact(conn, location, expertise, window, kind):
+    """(content, etag) precomputed by the nightly batch, or None when missing, stale or disabled"""
+    if not USE_PRECOMPUTED:
+        return None
+    return models.analytics_artifact(conn, location, expertise, window, kind)
+
+
+def stored_analytics(conn, location, expertise, window):
+    stored = stored_artifact(conn, location, expertise, window, 'result')
+    return AnalyticsResult.from_json(window, stored[0]) if stored else None
+
+
+def get_analytics(conn, location, expertise, window=None):
+    """Cached analytics; recomputed once newer appointments exist or the TTL lapses.
+
+    On a cache miss the nightly batch's stored result is used when it is
+    still current, and compute_analytics() runs otherwise.
+    """
+    window = window or resolve_window()
+    # The window's first and last day are part of the key so entries roll over at midnight
+    return analytics_cache.get_or_compute(
+        (location, expertise, window),
+        lambda: (stored_analytics(conn, location, expertise, window)
+                 or compute_analytics(conn, location, expertise, window)),
+        watermark=appointments_watermark(conn),
+    )
@@ -1,50 +1,83 @@
 import os
+import base64
 import csv
+import hmac
 import io
 import json
 import logging
+import zlib
 from datetime import datetime
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, Response, jsonify, make_response, stream_with_context
 import psycopg2
-import psycopg2.extras
+import assets
+import business_time
+import charts
+import compression
+import conditional
+import db
+import fallback
+import ingest
+import live
+import logs
+import metrics
+import models
+import pagination
+import precompute
+import rollup
+import sessions
+from analytics import DEFAULT_RANGE, InvalidWindow, analytics_cache, get_analytics, report_csv, resolve_window, stored_artifact
+from db import get_db_connection
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging: records go through a queue to a writer thread, as JSON
+# unless LOG_FORMAT=text, at LOG_LEVEL (default INFO)
+logs.configure()
 logger = logging.getLogger(__name__)
 
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", os.environ.get("SESSION_SECRET", "default_secret_key"))
 
-# Database connection function
-def get_db_connection():
-    try:
-        # First try to use DATABASE_URL (common in Railway, Heroku, Render)
-        database_url = os.environ.get("DATABASE_URL")
-        
-        if database_url:
-            # Handle Heroku's postgres:// vs postgresql:// issue
-            if database_url.startswith("postgres://"):
-                database_url = database_url.replace("postgres://", "postgresql://", 1)
-            
-            conn = psycopg2.connect(database_url)
-            conn.autocommit = True
-            return conn
-        
-        # Fall back to individual parameters
-        conn = psycopg2.connect(
-            host=os.environ.get("PGHOST", "localhost"),
-            dbname=os.environ.get("PGDATABASE", "utilities_db"),
-            user=os.environ.get("PGUSER", "utilities_user"),
-            password=os.environ.get("PGPASSWORD", "securepassword"),
-            port=os.environ.get("PGPORT", "5432")
-        )
-        conn.autocommit = True
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        return None
+# Rows fetched per round trip when streaming CSV exports
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 2000))
+
+# Rejected rows listed in an ingestion response (all are counted)
+INGEST_REJECTS_REPORTED = 100
+
+# History search: longest accepted query, and how deep results can be paged
+SEARCH_MAX_QUERY_LENGTH = 200
+SEARCH_MAX_OFFSET = 1000
+
+# Range of the server-rendered trend chart when no ?range= is given
+CHART_DEFAULT_RANGE = '14d'
+
+# Request ids on log records and responses, and per-endpoint log sampling
+logs.init_app(app)
+
+# Server-side sessions; the cookie holds only a session id
+sessions.init_app(app)
+
+# Pooled database connections are returned automatically at request teardown
+db.init_app(app)
+
+# Per-route latency, DB, template and chart timings, served at /metrics
+metrics.init_app(app)
+
+# gzip/brotli response bodies, negotiated on Accept-Encoding
+compression.init_app(app)
+
+# Content-hashed static URLs, cached by browsers for a year
+assets.init_app(app)
+
+@metrics.register_collector
+def _cache_metrics():
+    samples = []
+    for cache_name, stats in (('analytics', analytics_cache.stats()), ('charts', charts.chart_cache.stats()),
+                              ('technicians', sessions.technician_cache.stats())):
+        for result in ('hits', 'misses', 'invalidations'):
+            samples.append(({'cache': cache_name, 'result': result}, stats[result]))
+    return ('portal_cache_lookups_total', 'counter', 'Cache lookups by outcome', samples)
 
 # Login required decorator
 def login_required(f):
@@ -53,9 +86,40 @@ def login_required(f):
         if 'technician_id' not in session:
             flash('Please login to access this page', 'danger')
             return redirect(url_for('login'))
+        # Sets g.technician, normally from the cache without a query
+        try:
+            technician = sessions.current_technician()
+        except sessions.DatabaseUnavailable:
+            flash('Could not connect to database', 'danger')
+            return redirect(url_for('login'))
+        if technician is None:
+            session.clear()
+            flash('Please login to access this page', 'danger')
+            return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
+def render_fallback(view, key, template, **empty):
+    """Render the last good data of a page, flagged as stale, while the database is unavailable.
+
+    Falls back to ``empty`` (the page's no-data context) when nothing has
+    been stored for ``key`` yet.
+    """
+    stale = fallback.recall(view, key)
+    if stale is None:
+        flash('Could not connect to database', 'danger')
+        return render_template(template, **empty)
+    stored_at, context = stale
+    flash(f"The database is unavailable. Showing data as of {stored_at.strftime('%Y-%m-%d %H:%M')}; "
+          f"it may be out of date.", 'warning')
+    response = make_response(render_template(template, **context))
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def requested_window(default_range=DEFAULT_RANGE):
+    """Analytics window from ?range= (7d, 12w, 12m, ...) and ?granularity= (day, week, month)"""
+    return resolve_window(request.args.get('range') or default_range, request.args.get('granularity'))
+
 # Routes
 @app.route('/')
 def index():
@@ -72,17 +136,11 @@ def login():
             flash('Could not connect to database', 'danger')
             return render_template('login.html')
         
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT * FROM technicians WHERE email = %s AND password = %s", (email, password))
-        technician = cur.fetchone()
-        cur.close()
+        technician = models.authenticate_technician(conn, email, password)
         conn.close()
         
         if technician:
-            session['technician_id'] = technician['id']
-            session['technician_name'] = technician['name']
-            session['technician_expertise'] = technician['expertise']
-            session['technician_location'] = technician['location']
+            sessions.sign_in(technician)
             return redirect(url_for('dashboard'))
         else:
             flash('Invalid email or password', 'danger')
@@ -92,201 +150,274 @@ def login():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    conn = get_db_connection()
+    # Today's bounds in the business timezone as a half-open created_at range
+    day_start, day_end = business_time.day_range()
+    
+    # Get technician data
+    expertise = g.technician.expertise
+    location = g.technician.location
+    fallback_key = (location, expertise, day_start)
+    
+    conn = get_db_connection(role='read')
     if not conn:
-        flash('Could not connect to database', 'danger')
-        return render_template('dashboard.html', appointments=[])
+        return render_fallback('dashboard', fallback_key, 'dashboard.html', appointments=[])
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        # Unchanged since the browser's copy: answer 304 without the full query
+        fingerprint = models.appointments_range_fingerprint(conn, location, expertise, day_start, day_end)
+        etag = conditional.etag_for('dashboard', fingerprint, day_start)
+        modified = conditional.last_modified(fingerprint[1])
+        if conditional.is_fresh(etag, modified):
+            return conditional.not_modified(etag, modified)
+        
+        # Find appointments matching technician expertise and location, and created today
+        appointments = models.todays_appointments(conn, location, expertise, day_start, day_end)
+    except psycopg2.OperationalError as e:
+        logger.error("Error loading dashboard: %s", e)
+        return render_fallback('dashboard', fallback_key, 'dashboard.html', appointments=[])
+    finally:
+        conn.close()
     
-    # Get current date in YYYY-MM-DD format for filtering
-    today_date = datetime.now().strftime('%Y-%m-%d')
+    fallback.remember('dashboard', fallback_key, {'appointments': appointments})
+    response = make_response(render_template('dashboard.html', appointments=appointments))
+    return conditional.tag(response, etag, modified)
+
+@app.route('/dashboard/stream')
+@login_required
+def dashboard_stream():
+    """Server-sent events for new appointments matching this technician, pushed as they are inserted"""
+    expertise = g.technician.expertise
+    location = g.technician.location
     
-    # Get technician data
-    expertise = session.get('technician_expertise')
-    location = session.get('technician_location')
-    
-    # Find appointments matching technician expertise and location, and created today
-    cur.execute("""
-        SELECT * FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s 
-        AND DATE(created_at) = %s
-        ORDER BY created_at DESC
-    """, (location, f"%{expertise}%", today_date))
-    
-    appointments = cur.fetchall()
-    cur.close()
-    conn.close()
+    try:
+        subscription = live.get_broadcaster().subscribe(location, expertise)
+    except live.TooManySubscribers as e:
+        logger.warning("Live dashboard stream rejected: %s", e)
+        return Response('Too many live connections\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
     
-    return render_template('dashboard.html', appointments=appointments)
+    return Response(
+        live.event_stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/profile')
 @login_required
 def profile():
-    conn = get_db_connection()
+    return render_template('profile.html', technician=g.technician)
+
+def fetch_history_page(conn, location, expertise, after=None, limit=pagination.DEFAULT_PAGE_SIZE):
+    """Return one keyset page of history, newest first, plus the next page's cursor.
+
+    ``after`` is the (created_at, id) position of the last row already shown, so
+    each page is a bounded index range read however deep the history goes.
+    """
+    rows = models.history_page(conn, location, expertise, after, limit)
+    return pagination.split_page(rows, limit)
+
+@app.route('/history')
+@login_required
+def history():
+    limit = pagination.page_size(request.args.get('limit'))
+    try:
+        after = pagination.decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except pagination.InvalidCursor:
+        flash('Invalid page link, showing the latest appointments', 'warning')
+        after = None
+    
+    # Get technician data
+    expertise = g.technician.expertise
+    location = g.technician.location
+    fallback_key = (location, expertise, after, limit)
+    empty = {'appointments': [], 'next_cursor': None, 'page_size': limit}
+    
+    conn = get_db_connection(role='read')
     if not conn:
-        flash('Could not connect to database', 'danger')
-        return render_template('profile.html', technician=None)
+        return render_fallback('history', fallback_key, 'history.html', **empty)
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute("SELECT * FROM technicians WHERE id = %s", (session['technician_id'],))
-    technician = cur.fetchone()
-    cur.close()
-    conn.close()
+    try:
+        fingerprint = models.appointments_fingerprint(conn, location, expertise)
+        etag = conditional.etag_for('history', fingerprint)
+        modified = conditional.last_modified(fingerprint[1])
+        if conditional.is_fresh(etag, modified):
+            return conditional.not_modified(etag, modified)
+        
+        # Find one page of appointments matching technician expertise and location
+        appointments, next_cursor = fetch_history_page(conn, location, expertise, after, limit)
+    except psycopg2.OperationalError as e:
+        logger.error("Error loading history: %s", e)
+        return render_fallback('history', fallback_key, 'history.html', **empty)
+    finally:
+        conn.close()
     
-    return render_template('profile.html', technician=technician)
+    context = {'appointments': appointments, 'next_cursor': next_cursor, 'page_size': limit}
+    fallback.remember('history', fallback_key, context)
+    response = make_response(render_template('history.html', **context))
+    return conditional.tag(response, etag, modified)
 
-@app.route('/history')
+@app.route('/api/history')
 @login_required
-def history():
-    conn = get_db_connection()
+def history_api():
+    """Return a page of history as JSON for the 'Load more' button"""
+    limit = pagination.page_size(request.args.get('limit'))
+    try:
+        after = pagination.decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except pagination.InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db_connection(role='read')
     if not conn:
-        flash('Could not connect to database', 'danger')
-        return render_template('history.html', appointments=[])
+        return jsonify({'error': 'Database connection failed'}), 503
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    expertise = g.technician.expertise
+    location = g.technician.location
     
-    # Get technician data
-    expertise = session.get('technician_expertise')
-    location = session.get('technician_location')
+    try:
+        appointments, next_cursor = fetch_history_page(conn, location, expertise, after, limit)
+    except psycopg2.OperationalError as e:
+        logger.error("Error loading history page: %s", e)
+        return jsonify({'error': 'History is temporarily unavailable'}), 503
+    finally:
+        conn.close()
     
-    # Find all appointments matching technician expertise and location
-    cur.execute("""
-        SELECT * FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s 
-        ORDER BY created_at DESC
-    """, (location, f"%{expertise}%"))
-    
-    appointments = cur.fetchall()
-    cur.close()
-    conn.close()
+    return jsonify({
+        'appointments': [models.appointment_to_json(a) for a in appointments],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/api/history/search')
+@login_required
+def history_search_api():
+    """Ranked full-text search over the technician's history (client name, issue, description)"""
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'error': 'q is required'}), 400
+    if len(text) > SEARCH_MAX_QUERY_LENGTH:
+        return jsonify({'error': f'q is longer than {SEARCH_MAX_QUERY_LENGTH} characters'}), 400
+    limit = pagination.page_size(request.args.get('limit'))
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    if offset >= SEARCH_MAX_OFFSET:
+        return jsonify({'error': f'only the first {SEARCH_MAX_OFFSET} results are available, refine the search'}), 400
     
-    return render_template('history.html', appointments=appointments)
+    conn = get_db_connection(role='read')
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 503
+    
+    expertise = g.technician.expertise
+    location = g.technician.location
+    
+    try:
+        hits = models.search_appointments(conn, location, expertise, text, limit, offset)
+    except psycopg2.OperationalError as e:
+        logger.error("Error searching history: %s", e)
+        return jsonify({'error': 'Search is temporarily unavailable'}), 503
+    finally:
+        conn.close()
+    
+    more = len(hits) > limit and offset + limit < SEARCH_MAX_OFFSET
+    return jsonify({
+        'appointments': [dict(models.appointment_to_json(a), rank=round(rank, 6)) for a, rank in hits[:limit]],
+        'next_offset': offset + limit if more else None
+    })
 
 @app.route('/analytics')
 @login_required
 def analytics():
-    conn = get_db_connection()
-    if not conn:
-        flash('Could not connect to database', 'danger')
-        return render_template('analytics.html', analytics_data={})
-    
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        window = requested_window()
+    except InvalidWindow as e:
+        flash(f"{e}. Showing the default range.", 'warning')
+        window = resolve_window()
     
     # Get technician data
-    expertise = session.get('technician_expertise')
-    location = session.get('technician_location')
-    
-    # Total appointments handled by this technician
-    cur.execute("""
-        SELECT COUNT(*) as total_appointments
-        FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s
-    """, (location, f"%{expertise}%"))
-    
-    total_count_result = cur.fetchone()
-    total_count = total_count_result['total_appointments'] if total_count_result else 0
-    
-    # Appointments per day (last 7 days)
-    cur.execute("""
-        SELECT DATE(created_at) as date, COUNT(*) as count
-        FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s
-        AND created_at >= NOW() - INTERVAL '7 days'
-        GROUP BY DATE(created_at)
-        ORDER BY date
-    """, (location, f"%{expertise}%"))
-    
-    daily_data = cur.fetchall()
-    
-    # Types of issues handled
-    cur.execute("""
-        SELECT intent, COUNT(*) as count
-        FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s
-        GROUP BY intent
-        ORDER BY count DESC
-    """, (location, f"%{expertise}%"))
-    
-    issues_data = cur.fetchall()
-    
-    cur.close()
-    conn.close()
-    
-    # Format data for charts
-    dates = [row['date'].strftime('%Y-%m-%d') for row in daily_data]
-    daily_counts = [row['count'] for row in daily_data]
+    expertise = g.technician.expertise
+    location = g.technician.location
+    fallback_key = (location, expertise, window)
     
-    issues = [row['intent'] for row in issues_data]
-    issue_counts = [row['count'] for row in issues_data]
+    conn = get_db_connection(role='read')
+    if not conn:
+        return render_fallback('analytics', fallback_key, 'analytics.html', analytics_data={}, window=window)
     
-    analytics_data = {
-        'total_count': total_count,
-        'dates': dates,
-        'daily_counts': daily_counts,
-        'issues': issues,
-        'issue_counts': issue_counts
-    }
+    try:
+        # Totals, bucketed counts for the window and issue types in one scan
+        result = get_analytics(conn, location, expertise, window)
+    except psycopg2.OperationalError as e:
+        logger.error("Error loading analytics: %s", e)
+        return render_fallback('analytics', fallback_key, 'analytics.html', analytics_data={}, window=window)
+    finally:
+        conn.close()
     
-    return render_template('analytics.html', analytics_data=analytics_data)
+    context = {'analytics_data': result.to_dict(), 'window': window}
+    fallback.remember('analytics', fallback_key, context)
+    return render_template('analytics.html', **context)
 
 @app.route('/export/history/csv')
 @login_required
 def export_history_csv():
-    conn = get_db_connection()
+    """Stream the technician's appointment history as CSV (gzip with ?gzip=true)"""
+    conn = get_db_connection(role='read')
     if not conn:
         flash('Could not connect to database', 'danger')
         return redirect(url_for('history'))
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    # Named cursors are server-side and need a transaction; the pool restores
+    # autocommit when the connection is returned
+    conn.autocommit = False
     
     # Get technician data
-    expertise = session.get('technician_expertise')
-    location = session.get('technician_location')
+    expertise = g.technician.expertise
+    location = g.technician.location
     
     # Find all appointments matching technician expertise and location
-    cur.execute("""
-        SELECT * FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s 
-        ORDER BY created_at DESC
-    """, (location, f"%{expertise}%"))
-    
-    appointments = cur.fetchall()
-    cur.close()
-    conn.close()
+    cur = models.history_export_cursor(conn, location, expertise)
     
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Write header
-    writer.writerow(['Date', 'Time Slot', 'Client Name', 'Issue Type', 'Problem Description', 'Location', 'Contact'])
-    
-    # Write appointment data
-    for appointment in appointments:
-        writer.writerow([
-            appointment['created_at'].strftime('%Y-%m-%d'),
-            appointment['time_slot'],
-            appointment['name'],
-            appointment['intent'],
-            appointment['problem_description'],
-            appointment['location'],
-            appointment['contact']
-        ])
-    
-    # Prepare response
-    output.seek(0)
+    compress = request.args.get('gzip') == 'true'
     now = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"appointment_history_{now}.csv"
     
+    def generate_csv():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        
+        # Write header
+        writer.writerow(models.HISTORY_EXPORT_HEADER)
+        yield output.getvalue()
+        
+        # Write appointment data one batch at a time so memory stays flat
+        try:
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                output.seek(0)
+                output.truncate()
+                writer.writerows(rows)
+                yield output.getvalue()
+        finally:
+            cur.close()
+            conn.close()
+    
+    def generate_gzip():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+        for chunk in generate_csv():
+            data = compressor.compress(chunk.encode('utf-8'))
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    if compress:
+        return Response(
+            stream_with_context(generate_gzip()),
+            mimetype="application/gzip",
+            headers={"Content-Disposition": f"attachment;filename={filename}.gz"}
+        )
+    
     return Response(
-        output.getvalue(),
+        stream_with_context(generate_csv()),
         mimetype="text/csv",
         headers={"Content-Disposition": f"attachment;filename={filename}"}
     )
@@ -294,46 +425,28 @@ def export_history_csv():
 @app.route('/export/analytics/csv')
 @login_required
 def export_analytics_csv():
-    conn = get_db_connection()
+    try:
+        window = requested_window()
+    except InvalidWindow as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('analytics'))
+    
+    conn = get_db_connection(role='read')
     if not conn:
         flash('Could not connect to database', 'danger')
         return redirect(url_for('analytics'))
     
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    
     # Get technician data
-    expertise = session.get('technician_expertise')
-    location = session.get('technician_location')
-    technician_name = session.get('technician_name')
-    
-    # Get analytics data
-    
-    # Daily appointment counts
-    cur.execute("""
-        SELECT DATE(created_at) as date, COUNT(*) as count
-        FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s
-        AND created_at >= NOW() - INTERVAL '7 days'
-        GROUP BY DATE(created_at)
-        ORDER BY date
-    """, (location, f"%{expertise}%"))
-    
-    daily_data = cur.fetchall()
-    
-    # Issue type distribution
-    cur.execute("""
-        SELECT intent, COUNT(*) as count
-        FROM appointments 
-        WHERE location = %s 
-        AND intent LIKE %s
-        GROUP BY intent
-        ORDER BY count DESC
-    """, (location, f"%{expertise}%"))
-    
-    issues_data = cur.fetchall()
-    
-    cur.close()
+    expertise = g.technician.expertise
+    location = g.technician.location
+    technician_name = g.technician.name
+    
+    # Report body as stored by the nightly batch, or rendered from the analytics
+    stored = stored_artifact(conn, location, expertise, window, 'csv')
+    if stored is not None:
+        body = stored[0].decode('utf-8')
+    else:
+        body = report_csv(get_analytics(conn, location, expertise, window))
     conn.close()
     
     # Create CSV in memory
@@ -348,19 +461,7 @@ def export_analytics_csv():
     writer.writerow(['Expertise:', expertise])
     writer.writerow(['Location:', location])
     writer.writerow([])
-    
-    # Write daily appointments section
-    writer.writerow(['Daily Appointments (Last 7 Days)'])
-    writer.writerow(['Date', 'Number of Appointments'])
-    for row in daily_data:
-        writer.writerow([row['date'].strftime('%Y-%m-%d'), row['count']])
-    writer.writerow([])
-    
-    # Write issue types section
-    writer.writerow(['Issue Types Distribution'])
-    writer.writerow(['Issue Type', 'Number of Appointments'])
-    for row in issues_data:
-        writer.writerow([row['intent'], row['count']])
+    output.write(body)
     
     # Prepare response
     output.seek(0)
@@ -377,80 +478,108 @@ def export_analytics_csv():
 @login_required
 def export_chart_data():
     """Return chart data as JSON for client-side chart export"""
-    conn = get_db_connection()
+    try:
+        window = requested_window()
+    except InvalidWindow as e:
+        return jsonify({'error': str(e)}), 400
+    
+    conn = get_db_connection(role='read')
     if not conn:
         return jsonify({'error': 'Database connection failed'})
     
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
         # Get technician data
-        expertise = session.get('technician_expertise')
-        location = session.get('technician_location')
-        
-        # Total appointments
-        cur.execute("""
-            SELECT COUNT(*) as total_appointments
-            FROM appointments 
-            WHERE location = %s 
-            AND intent LIKE %s
-        """, (location, f"%{expertise}%"))
-        
-        total_count_result = cur.fetchone()
-        total_count = total_count_result['total_appointments'] if total_count_result else 0
-        
-        # Appointments per day (last 7 days)
-        cur.execute("""
-            SELECT DATE(created_at) as date, COUNT(*) as count
-            FROM appointments 
-            WHERE location = %s 
-            AND intent LIKE %s
-            AND created_at >= NOW() - INTERVAL '7 days'
-            GROUP BY DATE(created_at)
-            ORDER BY date
-        """, (location, f"%{expertise}%"))
-        
-        daily_data = cur.fetchall()
-        
-        # Types of issues handled
-        cur.execute("""
-            SELECT intent, COUNT(*) as count
-            FROM appointments 
-            WHERE location = %s 
-            AND intent LIKE %s
-            GROUP BY intent
-            ORDER BY count DESC
-        """, (location, f"%{expertise}%"))
+        expertise = g.technician.expertise
+        location = g.technician.location
         
-        issues_data = cur.fetchall()
+        # The analytics window ends today, so the date is part of the tag
+        fingerprint = models.appointments_fingerprint(conn, location, expertise)
+        day_start = business_time.day_start(business_time.today())
+        etag = conditional.etag_for('chart-data', fingerprint, day_start)
+        modified = conditional.last_modified(max(filter(None, (fingerprint[1], day_start))))
+        if conditional.is_fresh(etag, modified):
+            conn.close()
+            return conditional.not_modified(etag, modified)
         
-        cur.close()
+        result = get_analytics(conn, location, expertise, window)
         conn.close()
         
-        # Format data for charts
-        dates = [row['date'].strftime('%Y-%m-%d') for row in daily_data]
-        daily_counts = [row['count'] for row in daily_data]
-        
-        issues = [row['intent'] for row in issues_data]
-        issue_counts = [row['count'] for row in issues_data]
-        
-        return jsonify({
+        return conditional.tag(jsonify({
             'technician': {
-                'name': session.get('technician_name'),
+                'name': g.technician.name,
                 'expertise': expertise,
                 'location': location
             },
-            'total_count': total_count,
-            'dates': dates,
-            'daily_counts': daily_counts,
-            'issues': issues,
-            'issue_counts': issue_counts,
+            **result.to_dict(),
             'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        }), etag, modified)
     except Exception as e:
-        logger.error(f"Error exporting chart data: {e}")
+        logger.error("Error exporting chart data: %s", e)
         return jsonify({'error': str(e)})
 
+@app.route('/health/db')
+def db_health():
+    """Connection pool statistics for sizing DB_POOL_MIN_SIZE / DB_POOL_MAX_SIZE, circuit breaker and replica state"""
+    return jsonify({'pid': os.getpid(), 'pool': db.pool_stats(), 'circuit': db.breaker.stats(),
+                    'read_replicas': db.replica_stats()})
+
+@app.route('/health/cache')
+def cache_health():
+    """Hit/miss counters of the analytics and rendered-chart caches"""
+    return jsonify({
+        'pid': os.getpid(),
+        'analytics': analytics_cache.stats(),
+        'technicians': sessions.technician_cache.stats(),
+        'charts': dict(charts.chart_cache.stats(), bytes=charts.chart_cache.backend.weight, pool=charts.pool_stats())
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics for this worker process"""
+    if metrics.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {metrics.METRICS_TOKEN}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/appointments/ingest', methods=['POST'])
+def ingest_appointments():
+    """Bulk-load appointments from a JSONL (default) or ``?format=csv`` request body.
+
+    Requires ``Authorization: Bearer $INGEST_TOKEN``.  Rows already loaded
+    (same source_key) are skipped, so a failed upload can be retried as is.
+    """
+    if not ingest.INGEST_TOKEN:
+        return jsonify({'error': 'Ingestion is disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {ingest.INGEST_TOKEN}"):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in ('jsonl', 'csv'):
+        return jsonify({'error': 'format must be jsonl or csv'}), 400
+    try:
+        batch_size = max(1, int(request.args.get('batch_size', ingest.BATCH_SIZE)))
+    except ValueError:
+        return jsonify({'error': 'batch_size must be an integer'}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Database connection failed'}), 503
+
+    rejects = []
+    def on_reject(line_number, reason, record):
+        if len(rejects) < INGEST_REJECTS_REPORTED:
+            rejects.append({'line': line_number, 'reason': reason})
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+    try:
+        result = ingest.ingest(conn, ingest.reader_for(fmt, stream), batch_size, on_reject)
+    except Exception as e:
+        # Batches committed before the failure stay loaded; re-sending skips them
+        logger.error("Error ingesting appointments: %s", e)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    return jsonify(dict(result._asdict(), rejects=rejects))
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -460,202 +589,140 @@ def logout():
 @app.route('/matplotlib-charts/<chart_type>')
 @login_required
 def matplotlib_charts(chart_type):
-    """Generate Matplotlib charts on the server side"""
-    import matplotlib.pyplot as plt
-    import numpy as np
-    import pandas as pd
-    from matplotlib.figure import Figure
-    import io
-    import base64
+    """Generate Matplotlib charts on the server side.
+    
+    ``?format=png`` returns the image itself with a strong ETag (304 when the
+    browser's copy is current), ``?download=true`` returns it as an
+    attachment, and the default is an ``<img>`` tag with the PNG inlined.
+    """
+    if chart_type not in charts.CHART_TYPES:
+        return jsonify({'error': 'Invalid chart type'})
+    try:
+        window = requested_window(CHART_DEFAULT_RANGE)
+    except InvalidWindow as e:
+        return jsonify({'error': str(e)}), 400
     
-    conn = get_db_connection()
+    conn = get_db_connection(role='read')
     if not conn:
         return jsonify({'error': 'Database connection failed'})
     
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
         # Get technician data
-        expertise = session.get('technician_expertise')
-        location = session.get('technician_location')
-        technician_name = session.get('technician_name')
-        
-        # Create a figure with custom styling
-        plt.style.use('dark_background')  # Dark theme to match our application
-        fig = Figure(figsize=(10, 6))
-        ax = fig.subplots()
+        expertise = g.technician.expertise
+        location = g.technician.location
         
-        # Set the title with technician info
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        title_text = f'Analytics for {technician_name} - {expertise} - {location}\nGenerated: {timestamp}'
+        result = get_analytics(conn, location, expertise, window)
+        etag = charts.fingerprint(chart_type, location, expertise, result)
+        if etag not in request.if_none_match:
+            # Use the image rendered by the nightly batch when it is current
+            charts.load_stored_png(conn, chart_type, location, expertise, window, etag)
+        conn.close()
         
-        if chart_type == 'daily':
-            # Daily appointment trend
-            cur.execute("""
-                SELECT DATE(created_at) as date, COUNT(*) as count
-                FROM appointments 
-                WHERE location = %s 
-                AND intent LIKE %s
-                AND created_at >= NOW() - INTERVAL '14 days'
-                GROUP BY DATE(created_at)
-                ORDER BY date
-            """, (location, f"%{expertise}%"))
-            
-            daily_data = cur.fetchall()
-            
-            if not daily_data:
-                ax.text(0.5, 0.5, 'No data available for the selected period', 
-                       horizontalalignment='center', verticalalignment='center')
-            else:
-                # Convert to pandas DataFrame for easier manipulation
-                # Extract data from the DictRows into lists
-                dates = [row['date'] for row in daily_data]
-                counts = [row['count'] for row in daily_data]
-                
-                # Create DataFrame with explicit column names
-                df = pd.DataFrame({'date': dates, 'count': counts})
-                df['date'] = pd.to_datetime(df['date'])
-                df = df.sort_values('date')
-                
-                # Plot the data
-                ax.plot(df['date'], df['count'], marker='o', linestyle='-', linewidth=2)
-                ax.set_title(f'Daily Appointments Trend\n{title_text}')
-                ax.set_xlabel('Date')
-                ax.set_ylabel('Number of Appointments')
-                ax.grid(True, alpha=0.3)
-                
-                # Format x-axis to show dates properly
-                fig.autofmt_xdate()
-                
-                # Add data labels
-                for i, count in enumerate(df['count']):
-                    ax.annotate(str(count), (df['date'].iloc[i], count),
-                               textcoords="offset points", xytext=(0,5), ha='center')
+        download = request.args.get('download') == 'true'
         
-        elif chart_type == 'issues':
-            # Issue types distribution
-            cur.execute("""
-                SELECT intent, COUNT(*) as count
-                FROM appointments 
-                WHERE location = %s 
-                AND intent LIKE %s
-                GROUP BY intent
-                ORDER BY count DESC
-                LIMIT 8
-            """, (location, f"%{expertise}%"))
-            
-            issues_data = cur.fetchall()
-            
-            if not issues_data:
-                ax.text(0.5, 0.5, 'No data available for issue types', 
-                       horizontalalignment='center', verticalalignment='center')
+        if download or request.args.get('format') == 'png':
+            if etag in request.if_none_match:
+                response = Response(status=304)
             else:
-                # Extract data from the DictRows into lists
-                intents = [row['intent'] for row in issues_data]
-                counts = [row['count'] for row in issues_data]
-                
-                # Create DataFrame with explicit column names
-                df = pd.DataFrame({'intent': intents, 'count': counts})
-                
-                # Create horizontal bar chart
-                bars = ax.barh(df['intent'], df['count'], color=plt.cm.viridis(np.linspace(0, 1, len(df))))
-                ax.set_title(f'Issue Types Distribution\n{title_text}')
-                ax.set_xlabel('Number of Appointments')
-                ax.set_ylabel('Issue Type')
-                
-                # Add count labels to bars
-                for bar in bars:
-                    width = bar.get_width()
-                    ax.annotate(f'{width}',
-                              xy=(width, bar.get_y() + bar.get_height()/2),
-                              xytext=(3, 0),  # 3 points horizontal offset
-                              textcoords="offset points",
-                              ha='left', va='center')
-                
-                # Adjust layout for better display of long text
-                plt.tight_layout()
-        
-        elif chart_type == 'pie':
-            # Pie chart of issue types
-            cur.execute("""
-                SELECT intent, COUNT(*) as count
-                FROM appointments 
-                WHERE location = %s 
-                AND intent LIKE %s
-                GROUP BY intent
-                ORDER BY count DESC
-            """, (location, f"%{expertise}%"))
-            
-            issues_data = cur.fetchall()
+                png = charts.get_chart_png(chart_type, location, expertise, result, etag)
+                response = Response(png, mimetype='image/png')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
             
-            if not issues_data:
-                ax.text(0.5, 0.5, 'No data available for issue types', 
-                       horizontalalignment='center', verticalalignment='center')
-            else:
-                # Extract data from the DictRows into lists
-                intents = [row['intent'] for row in issues_data]
-                counts = [row['count'] for row in issues_data]
-                
-                # Create DataFrame with explicit column names
-                df = pd.DataFrame({'intent': intents, 'count': counts})
-                
-                # Generate colors
-                colors = plt.cm.tab10(np.linspace(0, 1, len(df)))
-                
-                # Create pie chart
-                wedges, texts, autotexts = ax.pie(
-                    df['count'], 
-                    labels=df['intent'],
-                    autopct='%1.1f%%',
-                    colors=colors,
-                    shadow=True,
-                    startangle=90,
-                    textprops={'color': 'white'}
-                )
-                
-                # Ensure pie is drawn as a circle
-                ax.axis('equal')
-                ax.set_title(f'Issue Types Distribution (Pie Chart)\n{title_text}')
-                
-                # Make labels more readable
-                plt.setp(autotexts, size=9, weight="bold")
-                plt.setp(texts, size=8)
-                
-                # Add legend for better readability with many categories
-                if len(df) > 5:
-                    ax.legend(df['intent'], loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+            # For direct download as file
+            if download:
+                filename = f"matplotlib_{chart_type}_chart_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
+                response.headers['Content-Disposition'] = f"attachment;filename={filename}"
+            return response
         
-        else:
-            return jsonify({'error': 'Invalid chart type'})
-        
-        # Close database connection
-        cur.close()
-        conn.close()
-        
-        # Save plot to a temporary buffer and convert to base64 for embedding
-        buf = io.BytesIO()
-        fig.tight_layout()
-        fig.savefig(buf, format='png', dpi=100)
-        buf.seek(0)
-        
-        # For direct download as file
-        if request.args.get('download') == 'true':
-            buf.seek(0)
-            filename = f"matplotlib_{chart_type}_chart_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            return Response(
-                buf.getvalue(),
-                mimetype='image/png',
-                headers={"Content-Disposition": f"attachment;filename={filename}"}
-            )
-        
-        # For displaying in browser or embedding
-        data = base64.b64encode(buf.getvalue()).decode('utf-8')
+        # For embedding as an inline image
+        png = charts.get_chart_png(chart_type, location, expertise, result, etag)
+        data = base64.b64encode(png).decode('utf-8')
         return f"<img src='data:image/png;base64,{data}'/>"
         
+    except (charts.ChartPoolSaturated, charts.ChartRenderTimeout, charts.ChartPoolBroken) as e:
+        # Shed chart load rather than tie up request workers
+        logger.warning("Chart render rejected: %s", e)
+        response = jsonify({'error': 'Chart rendering is busy, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
     except Exception as e:
-        logger.error(f"Error generating Matplotlib chart: {e}")
+        logger.error("Error generating Matplotlib chart: %s", e)
         return jsonify({'error': str(e)})
 
+@app.cli.command('migrate')
+@click.option('--target', type=int, default=None, help='Stop at this schema version')
+def migrate_command(target):
+    """Apply pending schema migrations from models.py"""
+    conn = db.connect()
+    try:
+        version = models.migrate(conn, target)
+        if version >= 4 and not rollup.timezones_match(conn):
+            click.echo("Rollup timezones changed, rebuilding appointment rollup")
+            rollup.rebuild(conn)
+    finally:
+        conn.close()
+    click.echo(f"Schema at version {version}")
+
+@app.cli.command('rollup-rebuild')
+def rollup_rebuild_command():
+    """Backfill or rebuild the appointment rollup tables used by analytics"""
+    conn = db.connect()
+    try:
+        rows, appointments = rollup.rebuild(conn)
+    finally:
+        conn.close()
+    click.echo(f"Rollup rebuilt: {rows} daily rows covering {appointments} appointments")
+
+@app.cli.command('precompute-analytics')
+@click.option('--ranges', default=','.join(precompute.RANGES), show_default=True,
+              help='Comma-separated analytics windows to precompute')
+@click.option('--workers', type=int, default=precompute.WORKERS, show_default=True,
+              help='Render processes (0 renders in this process)')
+def precompute_analytics_command(ranges, workers):
+    """Store analytics, CSV reports and charts of every technician pair for the routes to serve"""
+    try:
+        windows = [value.strip() for value in ranges.split(',') if value.strip()]
+        for value in windows:
+            resolve_window(value)
+    except InvalidWindow as e:
+        raise click.BadParameter(str(e), param_hint='--ranges')
+    conn = db.connect()
+    try:
+        summary = precompute.run(conn, windows, workers)
+    finally:
+        conn.close()
+    click.echo(f"Stored {summary['artifacts']} artifacts ({summary['bytes']} bytes) for {summary['pairs']} "
+               f"technician pairs and windows {', '.join(summary['windows'])}; "
+               f"scan {summary['scan_seconds']}s, compute {summary['compute_seconds']}s, "
+               f"render {summary['render_seconds']}s, store {summary['store_seconds']}s")
+
+@app.cli.command('ingest')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None,
+              help='Input format (default: from the file extension)')
+@click.option('--batch-size', type=int, default=ingest.BATCH_SIZE, show_default=True)
+@click.option('--rejects', type=click.File('w', encoding='utf-8'), default=None,
+              help='Write rejected rows here as JSONL')
+def ingest_command(source, fmt, batch_size, rejects):
+    """Bulk-load appointments from a JSONL or CSV file ('-' for stdin) with COPY"""
+    fmt = fmt or ('csv' if source.name.endswith('.csv') else 'jsonl')
+
+    def on_reject(line_number, reason, record):
+        if rejects is not None:
+            rejects.write(json.dumps({'line': line_number, 'reason': reason, 'record': record}) + '\n')
+
+    conn = db.connect()
+    started = datetime.now()
+    try:
+        result = ingest.ingest(conn, ingest.reader_for(fmt, source), batch_size, on_reject)
+    finally:
+        conn.close()
+    elapsed = (datetime.now() - started).total_seconds()
+    click.echo(f"Read {result.read} rows in {elapsed:.1f}s: {result.inserted} inserted, "
+               f"{result.duplicates} already present, {result.rejected} rejected")
+
 if __name__ == '__main__':
     # Use PORT environment variable if available (commonly used by hosting providers)
     port = int(os.environ.get("PORT", 5000))
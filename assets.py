@@ -0,0 +1,61 @@
+import hashlib
+import os
+import threading
+from flask import current_app, request
+from werkzeug.security import safe_join
+
+# Lifetime of a fingerprinted static URL; new content gets a new URL
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_versions = {}
+_lock = threading.Lock()
+
+
+def asset_version(filename):
+    """Short content hash of a static file, or None if it does not exist.
+
+    Hashes are cached per file and recomputed only when its size or mtime
+    changes, so edits show up immediately in development.
+    """
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _versions.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with open(path, 'rb') as f:
+        version = hashlib.sha256(f.read()).hexdigest()[:12]
+    with _lock:
+        _versions[path] = (signature, version)
+    return version
+
+
+def _fingerprint_static_urls(endpoint, values):
+    # url_for('static', filename=...) gains ?v=<content hash>
+    if endpoint == 'static' and 'v' not in values and 'filename' in values:
+        version = asset_version(values['filename'])
+        if version is not None:
+            values['v'] = version
+
+
+def _static_cache_headers(response):
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    filename = (request.view_args or {}).get('filename')
+    version = request.args.get('v')
+    if version is not None and filename and version == asset_version(filename):
+        response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    else:
+        # Unversioned or outdated URL: the content may change under it
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def init_app(app):
+    app.url_defaults(_fingerprint_static_urls)
+    app.after_request(_static_cache_headers)
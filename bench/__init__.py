@@ -0,0 +1,4 @@
+# Benchmarks run against a real PostgreSQL database configured through
+# DATABASE_URL or the PG* environment variables, e.g.
+#
+#     python -m bench.intent_index --location Mumbai --expertise Plumbing
@@ -0,0 +1,55 @@
+"""Compare two bench.routes result files route by route.
+
+    python -m bench.compare bench_results/before.json bench_results/after.json
+"""
+import argparse
+import json
+
+COLUMNS = [
+    ('p50', lambda r: r['latency_ms']['p50']),
+    ('p95', lambda r: r['latency_ms']['p95']),
+    ('p99', lambda r: r['latency_ms']['p99']),
+    ('rps', lambda r: r['throughput_rps']),
+    ('queries', lambda r: r['db_queries_per_request']),
+    ('rss_kb', lambda r: r.get('peak_rss_kb')),
+]
+
+
+def _change(before, after):
+    if before is None or after is None:
+        return 'n/a'
+    if before == 0:
+        return f"{after:g}" if after else '='
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before, after):
+    rows = []
+    for name, result in after['routes'].items():
+        baseline = before['routes'].get(name)
+        if baseline is None:
+            continue
+        rows.append((name, [(label, get(baseline), get(result), _change(get(baseline), get(result)))
+                            for label, get in COLUMNS]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    for name, columns in compare(before, after):
+        print(name)
+        for label, old, new, change in columns:
+            print(f"  {label:8s} {str(old):>12s} -> {str(new):>12s}  {change}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Show that intent matching no longer sequential-scans appointments.
+
+Runs EXPLAIN ANALYZE for the technician filter used by every route, once with
+the planner free to use appointments_intent_trgm_idx and once with index
+scans disabled (the plan the leading-wildcard LIKE had before the index), and
+prints both plans' scan nodes and timings as JSON.
+"""
+import argparse
+import json
+import statistics
+
+import db
+
+QUERY = """
+    SELECT COUNT(*) FROM appointments
+    WHERE location = %s
+    AND intent LIKE %s
+"""
+
+
+def _scan_nodes(plan):
+    nodes = []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        if node.get('Relation Name') == 'appointments':
+            nodes.append(f"{node['Node Type']} ({node.get('Index Name', 'no index')})")
+        stack.extend(node.get('Plans', []))
+    return nodes
+
+
+def explain(cur, location, expertise, use_index, repeat):
+    cur.execute("BEGIN")
+    try:
+        if not use_index:
+            cur.execute("SET LOCAL enable_bitmapscan = off")
+            cur.execute("SET LOCAL enable_indexscan = off")
+        timings = []
+        plan = None
+        for _ in range(repeat):
+            cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + QUERY, (location, f"%{expertise}%"))
+            result = cur.fetchone()[0][0]
+            plan = result['Plan']
+            timings.append(result['Execution Time'])
+    finally:
+        cur.execute("ROLLBACK")
+    return {
+        'scans': _scan_nodes(plan),
+        'sequential_scan': any(n.startswith('Seq Scan') for n in _scan_nodes(plan)),
+        'execution_ms_median': round(statistics.median(timings), 3),
+        'execution_ms_min': round(min(timings), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--location', required=True)
+    parser.add_argument('--expertise', required=True)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    conn = db.connect()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM appointments")
+    rows = cur.fetchone()[0]
+    report = {
+        'rows': rows,
+        'location': args.location,
+        'expertise': args.expertise,
+        'indexed': explain(cur, args.location, args.expertise, True, args.repeat),
+        'without_index': explain(cur, args.location, args.expertise, False, args.repeat),
+    }
+    cur.close()
+    conn.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""Benchmark every portal route and save latency, throughput, query and memory figures as JSON.
+
+Two drivers are available:
+
+* ``client`` runs requests through the Flask test client in this process,
+  so it measures application cost without network or server overhead.
+* ``http`` sends concurrent requests to a running server (``--url``), or to
+  a gunicorn it starts itself (``--spawn-gunicorn``), and reads peak RSS of
+  the gunicorn processes from /proc.
+
+Database statement counts come from the Server-Timing header, which this
+script enables for the client driver; start an external server with
+SERVER_TIMING=1 to get them in http mode.
+
+    python -m bench.seed --appointments 1000000 --reset
+    python -m bench.routes --driver client --requests 200
+    python -m bench.routes --driver http --spawn-gunicorn --concurrency 16
+"""
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import re
+import resource
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROUTES = [
+    ('dashboard', '/dashboard'),
+    ('profile', '/profile'),
+    ('history', '/history'),
+    ('history_api', '/api/history'),
+    ('analytics', '/analytics'),
+    ('export_history_csv', '/export/history/csv'),
+    ('export_analytics_csv', '/export/analytics/csv'),
+    ('export_chart_data', '/export/chart-data'),
+    ('chart_daily', '/matplotlib-charts/daily?format=png'),
+    ('chart_issues', '/matplotlib-charts/issues?format=png'),
+    ('chart_pie', '/matplotlib-charts/pie?format=png'),
+]
+
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    # Nearest-rank percentile
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, wall_time, queries, statuses, bytes_total):
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / wall_time, 2) if wall_time else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'mean': round(statistics.fmean(latencies) * 1000, 3),
+            'max': round(max(latencies) * 1000, 3),
+        },
+        'db_queries_per_request': round(statistics.fmean(queries), 2) if queries else None,
+        'status_codes': {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        'mean_response_bytes': round(bytes_total / len(latencies)) if latencies else 0,
+    }
+
+
+def _queries(server_timing):
+    match = _QUERIES.search(server_timing or '')
+    return int(match.group(1)) if match else None
+
+
+def _peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_client(routes, requests, warmup, email, password):
+    import metrics
+    metrics.SERVER_TIMING = True
+    from app import app
+
+    client = app.test_client()
+    response = client.post('/login', data={'email': email, 'password': password})
+    if response.status_code != 302:
+        raise SystemExit(f"Login as {email} failed (status {response.status_code})")
+
+    results = {}
+    for name, path in routes:
+        for _ in range(warmup):
+            client.get(path).close()
+        rss_before = _peak_rss_kb()
+        latencies, queries, statuses, bytes_total = [], [], [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            t0 = time.perf_counter()
+            response = client.get(path)
+            body = response.get_data()
+            latencies.append(time.perf_counter() - t0)
+            statuses.append(response.status_code)
+            bytes_total += len(body)
+            count = _queries(response.headers.get('Server-Timing'))
+            if count is not None:
+                queries.append(count)
+        wall = time.perf_counter() - started
+        results[name] = summarize(latencies, wall, queries, statuses, bytes_total)
+        results[name]['peak_rss_kb'] = _peak_rss_kb()
+        results[name]['peak_rss_growth_kb'] = _peak_rss_kb() - rss_before
+        print(f"{name:22s} p50={results[name]['latency_ms']['p50']:9.2f}ms "
+              f"p99={results[name]['latency_ms']['p99']:9.2f}ms "
+              f"rps={results[name]['throughput_rps']}", file=sys.stderr)
+    return results
+
+
+def _process_tree(pid):
+    pids = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids.extend(_process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+
+def _peak_rss_of(pids):
+    peaks = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        peaks[pid] = int(line.split()[1])
+        except OSError:
+            pass
+    return peaks
+
+
+def _login_opener(base_url, email, password):
+    jar = http.cookiejar.CookieJar()
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar), NoRedirect)
+    data = urllib.parse.urlencode({'email': email, 'password': password}).encode()
+    try:
+        opener.open(base_url + '/login', data)
+    except urllib.error.HTTPError as e:
+        if e.code != 302:
+            raise
+    if not any(cookie.name == 'session' for cookie in jar):
+        raise SystemExit(f"Login as {email} failed")
+    return opener
+
+
+def run_http(routes, requests, warmup, email, password, base_url, concurrency, server_pid=None):
+    opener = _login_opener(base_url, email, password)
+    local = threading.local()
+
+    def fetch(path):
+        # One opener per thread shares the session cookie but not connection state
+        if not hasattr(local, 'opener'):
+            local.opener = _login_opener(base_url, email, password)
+        t0 = time.perf_counter()
+        try:
+            with local.opener.open(base_url + path, timeout=120) as response:
+                body = response.read()
+                status, timing = response.status, response.headers.get('Server-Timing')
+        except urllib.error.HTTPError as e:
+            body, status, timing = e.read(), e.code, e.headers.get('Server-Timing')
+        return time.perf_counter() - t0, status, len(body), _queries(timing)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for name, path in routes:
+            for _ in range(warmup):
+                opener.open(base_url + path, timeout=120).read()
+            started = time.perf_counter()
+            samples = list(pool.map(fetch, [path] * requests))
+            wall = time.perf_counter() - started
+            queries = [q for *_, q in samples if q is not None]
+            results[name] = summarize(
+                [s[0] for s in samples], wall, queries, [s[1] for s in samples], sum(s[2] for s in samples))
+            if server_pid:
+                peaks = _peak_rss_of(_process_tree(server_pid))
+                results[name]['peak_rss_kb'] = max(peaks.values()) if peaks else None
+                results[name]['peak_rss_by_pid_kb'] = {str(pid): kb for pid, kb in peaks.items()}
+            print(f"{name:22s} p50={results[name]['latency_ms']['p50']:9.2f}ms "
+                  f"p99={results[name]['latency_ms']['p99']:9.2f}ms "
+                  f"rps={results[name]['throughput_rps']}", file=sys.stderr)
+    return results
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def spawn_gunicorn(workers, extra_args=()):
+    """Start gunicorn on a free port and wait until it answers"""
+    port = _free_port()
+    env = dict(os.environ, SERVER_TIMING='1')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+         *extra_args, 'main:app'],
+        env=env)
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=1).read()
+            return process, base_url
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit('gunicorn exited during startup')
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit('gunicorn did not start within 60s')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--driver', choices=('client', 'http'), default='client')
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per route')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--routes', help='comma-separated subset of: ' + ', '.join(n for n, _ in ROUTES))
+    parser.add_argument('--email', default='tech0@bench.local')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--url', help='base URL of a running server (http driver)')
+    parser.add_argument('--server-pid', type=int, help='gunicorn master pid for RSS readings')
+    parser.add_argument('--spawn-gunicorn', action='store_true')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='JSON file (default bench_results/<driver>-<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    routes = ROUTES
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        routes = [(n, p) for n, p in ROUTES if n in wanted]
+
+    if args.driver == 'client':
+        results = run_client(routes, args.requests, args.warmup, args.email, args.password)
+    else:
+        process = None
+        base_url, server_pid = args.url, args.server_pid
+        if args.spawn_gunicorn:
+            process, base_url = spawn_gunicorn(args.workers)
+            server_pid = process.pid
+        if not base_url:
+            parser.error('--driver http needs --url or --spawn-gunicorn')
+        try:
+            results = run_http(routes, args.requests, args.warmup, args.email, args.password,
+                               base_url.rstrip('/'), args.concurrency, server_pid)
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=30)
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'driver': args.driver,
+        'requests_per_route': args.requests,
+        'concurrency': args.concurrency if args.driver == 'http' else 1,
+        'routes': results,
+    }
+    output = args.output or os.path.join(
+        'bench_results', f"{args.driver}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
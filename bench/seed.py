@@ -0,0 +1,148 @@
+"""Seed a database with synthetic technicians and appointments for benchmarking.
+
+Locations and intents follow a Zipf-like skew so a few pairs are hot and most
+are cold, and created_at is spread over --days with a bias towards recent
+days.  Rows are loaded with COPY, so 10M appointments take minutes.
+
+    python -m bench.seed --appointments 1000000 --reset
+"""
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta
+
+import db
+import models
+
+LOCATIONS = [
+    'Ahmedabad', 'Surat', 'Vadodara', 'Rajkot', 'New York', 'Los Angeles',
+    'Chicago', 'Gandhinagar', 'Bhavnagar', 'Jamnagar', 'Junagadh', 'Anand',
+]
+INTENTS = [
+    'Electrical', 'Plumbing', 'HVAC', 'Gas_Problem', 'AC_Repair_Cleaning',
+    'Lock_Repair', 'Carpenter_Request', 'Power_Outage', 'Switchboard_Issue',
+    'Leaking_Pipe', 'Elevator_Issue', 'Water_Heater', 'Pest_Control',
+    'Appliance_Repair', 'Roof_Leak', 'Painting',
+]
+FIRST_NAMES = ['Aarav', 'Priya', 'Ramesh', 'Nidhi', 'Kiran', 'Alice', 'Bob', 'Manish', 'Alka', 'Vikas']
+LAST_NAMES = ['Patel', 'Shah', 'Mehta', 'Joshi', 'Sharma', 'Desai', 'Rana', 'Verma', 'Smith', 'Johnson']
+SYMPTOMS = [
+    'stopped working this morning', 'makes a loud noise', 'leaking near the wall',
+    'sparks when switched on', 'smells of gas', 'does not cool', 'keeps tripping the breaker',
+    'door will not close', 'water pressure is low', 'display shows an error code',
+]
+TIME_SLOTS = ['09:00-11:00', '11:00-13:00', '13:00-15:00', '15:00-17:00', '17:00-19:00']
+
+BENCH_PASSWORD = 'bench'
+
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\t', ' ').replace('\n', ' ')
+
+
+def appointment_rows(count, days, rng, now):
+    location_weights = zipf_weights(len(LOCATIONS))
+    intent_weights = zipf_weights(len(INTENTS))
+    for _ in range(count):
+        intent = rng.choices(INTENTS, intent_weights)[0]
+        # Square of a uniform sample biases towards recent days
+        age = timedelta(seconds=int((rng.random() ** 2) * days * 86400))
+        yield (
+            intent,
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            f"{intent.replace('_', ' ')} {rng.choice(SYMPTOMS)}",
+            rng.choices(LOCATIONS, location_weights)[0],
+            f"+91 9{rng.randrange(10 ** 8, 10 ** 9)}",
+            rng.choice(TIME_SLOTS),
+            (now - age).strftime('%Y-%m-%d %H:%M:%S'),
+        )
+
+
+class _CopyBuffer(io.RawIOBase):
+    """File-like object that feeds generated rows to COPY without materialising them"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self._pending) < len(buffer):
+            chunk = []
+            for row in self._rows:
+                chunk.append('\t'.join(_escape(v) for v in row))
+                if len(chunk) >= 1000:
+                    break
+            if not chunk:
+                break
+            self._pending += ('\n'.join(chunk) + '\n').encode('utf-8')
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def seed(conn, appointments, technicians, days, seed_value=42, reset=False):
+    rng = random.Random(seed_value)
+    now = datetime.now()
+    models.migrate(conn)
+    cur = conn.cursor()
+    if reset:
+        # The truncate trigger (migration 13, applied above) also empties the
+        # rollup and stored artifacts, which describe the old rows
+        cur.execute("TRUNCATE appointments, technicians RESTART IDENTITY")
+
+    tech_rows = []
+    for i in range(technicians):
+        tech_rows.append((
+            f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            INTENTS[i % len(INTENTS)],
+            LOCATIONS[(i // len(INTENTS)) % len(LOCATIONS)],
+            f"+91 9{rng.randrange(10 ** 8, 10 ** 9)}",
+            f"tech{i}@bench.local",
+            BENCH_PASSWORD,
+        ))
+    cur.copy_expert(
+        "COPY technicians (name, expertise, location, contact, email, password) FROM STDIN",
+        _CopyBuffer(iter(tech_rows)))
+
+    started = time.perf_counter()
+    cur.copy_expert(
+        "COPY appointments (intent, name, problem_description, location, contact, time_slot, created_at) "
+        "FROM STDIN",
+        io.BufferedReader(_CopyBuffer(appointment_rows(appointments, days, rng, now)), 1 << 20))
+    elapsed = time.perf_counter() - started
+    cur.execute("ANALYZE appointments")
+    cur.execute("ANALYZE technicians")
+    cur.close()
+    return elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--appointments', type=int, default=100000, help='rows to generate (1k to 10M)')
+    parser.add_argument('--technicians', type=int, default=len(INTENTS) * len(LOCATIONS))
+    parser.add_argument('--days', type=int, default=730, help='history span in days')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='truncate appointments, technicians, the rollup and stored artifacts first')
+    args = parser.parse_args(argv)
+
+    conn = db.connect()
+    try:
+        elapsed = seed(conn, args.appointments, args.technicians, args.days, args.seed, args.reset)
+    finally:
+        conn.close()
+    print(f"Loaded {args.appointments} appointments in {elapsed:.1f}s "
+          f"({args.appointments / max(elapsed, 1e-9):,.0f} rows/s); "
+          f"log in as tech0@bench.local / {BENCH_PASSWORD}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Measure gunicorn start-up with and without preloading: time to first response and per-worker memory.
+
+Each round starts gunicorn on a free port (GUNICORN_PRELOAD=true, then
+false), times how long it takes until ``/login`` answers and, when a
+benchmark login works, how long the first chart takes.  Once the workers
+have settled, it reads RSS, PSS and private memory of the master, each
+worker and their render processes from /proc/<pid>/smaps_rollup.  PSS
+divides shared pages between the processes mapping them, so it shows
+what copy-on-write sharing saves where RSS does not.
+
+    python -m bench.startup --workers 4 --rounds 3
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+from bench.routes import _free_port, _login_opener, _process_tree
+
+MODES = (('preload', 'true'), ('no_preload', 'false'))
+
+
+def _memory_kb(pid):
+    """Rss, Pss and private (unshared) kB of a process, or None if it is gone"""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, rest = line.partition(':')
+                if name in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                    fields[name] = int(rest.split()[0])
+    except OSError:
+        return None
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def _children(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _wait_for(url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            if process.poll() is not None:
+                raise SystemExit('gunicorn exited during startup')
+            time.sleep(0.02)
+    raise SystemExit(f"gunicorn did not answer within {timeout}s")
+
+
+def measure(preload, workers, email, password, settle, timeout):
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, GUNICORN_PRELOAD=preload)
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'main:app'],
+        env=env)
+    try:
+        _wait_for(base_url + '/login', process, timeout)
+        result = {'time_to_first_request_s': round(time.perf_counter() - started, 3)}
+
+        try:
+            opener = _login_opener(base_url, email, password)
+        except (SystemExit, OSError) as e:
+            print(f"Skipping first-chart timing: {e}", file=sys.stderr)
+        else:
+            t0 = time.perf_counter()
+            try:
+                opener.open(base_url + '/matplotlib-charts/daily?format=png', timeout=120).read()
+                result['first_chart_s'] = round(time.perf_counter() - t0, 3)
+            except urllib.error.HTTPError as e:
+                print(f"First chart failed with status {e.code}", file=sys.stderr)
+
+        # Let post_worker_init and render-pool warm-up finish before reading memory
+        time.sleep(settle)
+        worker_pids = _children(process.pid)
+        result['master_kb'] = _memory_kb(process.pid)
+        result['workers_kb'] = {}
+        for pid in worker_pids:
+            helpers = [_memory_kb(child) for child in _process_tree(pid)[1:]]
+            result['workers_kb'][str(pid)] = dict(
+                _memory_kb(pid) or {},
+                helpers_pss=sum(h['pss'] for h in helpers if h),
+            )
+        result['total_pss_kb'] = sum(m['pss'] for m in filter(None, map(_memory_kb, _process_tree(process.pid))))
+        return result
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+
+
+def summarize(rounds):
+    """Median over rounds of the timing and memory figures"""
+    def median(values):
+        values = [v for v in values if v is not None]
+        return round(statistics.median(values), 3) if values else None
+
+    worker_rss = [statistics.mean(w['rss'] for w in r['workers_kb'].values()) for r in rounds if r['workers_kb']]
+    worker_pss = [statistics.mean(w['pss'] for w in r['workers_kb'].values()) for r in rounds if r['workers_kb']]
+    return {
+        'time_to_first_request_s': median([r['time_to_first_request_s'] for r in rounds]),
+        'first_chart_s': median([r.get('first_chart_s') for r in rounds]),
+        'worker_rss_kb': median(worker_rss),
+        'worker_pss_kb': median(worker_pss),
+        'total_pss_kb': median([r['total_pss_kb'] for r in rounds]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--email', default='tech0@bench.local')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to wait before reading memory')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='JSON file (default bench_results/startup-<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    modes = {}
+    for name, preload in MODES:
+        rounds = [measure(preload, args.workers, args.email, args.password, args.settle, args.timeout)
+                  for _ in range(args.rounds)]
+        modes[name] = {'summary': summarize(rounds), 'rounds': rounds}
+        summary = modes[name]['summary']
+        print(f"{name:11s} first request={summary['time_to_first_request_s']}s "
+              f"first chart={summary['first_chart_s']}s worker rss={summary['worker_rss_kb']}kB "
+              f"pss={summary['worker_pss_kb']}kB total pss={summary['total_pss_kb']}kB", file=sys.stderr)
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'workers': args.workers,
+        'rounds': args.rounds,
+        'modes': modes,
+    }
+    output = args.output or os.path.join('bench_results', f"startup-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
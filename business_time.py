@@ -0,0 +1,35 @@
+import os
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# Timezone whose calendar defines "today" for technicians
+BUSINESS_TIMEZONE = ZoneInfo(os.environ.get("BUSINESS_TIMEZONE", "UTC"))
+
+# Timezone in which the naive appointments.created_at values are written
+# (the database session TimeZone when rows use DEFAULT CURRENT_TIMESTAMP)
+STORAGE_TIMEZONE = ZoneInfo(os.environ.get("DB_TIMEZONE", "UTC"))
+
+
+def today():
+    return datetime.now(BUSINESS_TIMEZONE).date()
+
+
+def to_storage(local_dt):
+    """Convert an aware datetime to the naive storage time used by created_at"""
+    return local_dt.astimezone(STORAGE_TIMEZONE).replace(tzinfo=None)
+
+
+def day_start(day):
+    return to_storage(datetime.combine(day, time.min, tzinfo=BUSINESS_TIMEZONE))
+
+
+def day_range(day=None):
+    """Half-open [start, end) created_at range covering one business day"""
+    day = day or today()
+    return day_start(day), day_start(day + timedelta(days=1))
+
+
+def window_range(days, end_day=None):
+    """Half-open created_at range covering the last ``days`` business days, today included"""
+    end_day = end_day or today()
+    return day_start(end_day - timedelta(days=days - 1)), day_start(end_day + timedelta(days=1))
@@ -0,0 +1,237 @@
+import fnmatch
+import os
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # optional shared backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+class LRUBackend:
+    """In-process LRU store with per-entry TTL.
+
+    Bounded by ``max_entries`` and, when ``weigh`` is given, by the total
+    ``weigh(value)`` of all entries (e.g. bytes of rendered images).
+    """
+
+    def __init__(self, max_entries=1024, max_weight=None, weigh=None):
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value, _ = item
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        weight = self._weigh(value) if self._weigh else 0
+        if self.max_weight is not None and weight > self.max_weight:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, weight)
+            self._weight += weight
+            while len(self._entries) > self.max_entries or (
+                    self.max_weight is not None and self._weight > self.max_weight):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._weight -= item[2]
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._weight = 0
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LocalStore:
+    """Dict-backed stand-in for a Redis client (get/set/delete/scan_iter/flushdb)"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            item = self._data.get(name)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[name]
+                return None
+            return value
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(self._data.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match='*', count=None):
+        with self._lock:
+            names = [name for name in self._data if fnmatch.fnmatchcase(name, match)]
+        return iter(names)
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SharedBackend:
+    """Store shared between workers through a Redis-compatible client"""
+
+    def __init__(self, client, prefix='portal:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _name(self, key):
+        return self.prefix + repr(key)
+
+    def get(self, key):
+        try:
+            raw = self.client.get(self._name(key))
+        except Exception as e:
+            logger.warning("Shared cache read failed: %s", e)
+            return None
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set(self._name(key), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=max(1, int(ttl)))
+        except Exception as e:
+            logger.warning("Shared cache write failed: %s", e)
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._name(key))
+        except Exception as e:
+            logger.warning("Shared cache delete failed: %s", e)
+
+    def clear(self):
+        # Deletes only keys under this backend's prefix (which must not contain
+        # glob characters); other users of the same Redis are left alone
+        try:
+            names = list(self.client.scan_iter(match=self.prefix + '*', count=1000))
+            for start in range(0, len(names), 500):
+                self.client.delete(*names[start:start + 500])
+        except Exception as e:
+            logger.warning("Shared cache clear failed: %s", e)
+
+
+def make_backend(url=None, max_entries=1024, prefix='portal:'):
+    """Shared backend for ``url`` (``redis://...`` or ``local://``), else an in-process LRU"""
+    if url:
+        if url.startswith('local://'):
+            return SharedBackend(LocalStore(), prefix)
+        if redis is not None:
+            return SharedBackend(redis.Redis.from_url(url), prefix)
+        logger.warning("Shared cache URL configured but the redis package is not installed; "
+                       "using the in-process cache")
+    return LRUBackend(max_entries)
+
+
+class ResultCache:
+    """TTL cache whose entries are also invalidated by a data watermark.
+
+    Every entry is stored with the watermark of the data it was computed
+    from; a lookup with a newer watermark counts as a miss and the caller
+    recomputes.
+    """
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, watermark=None):
+        entry = self.backend.get(key)
+        if entry is not None:
+            stored_watermark, value = entry
+            if watermark is None or (stored_watermark is not None and stored_watermark >= watermark):
+                self._count('hits')
+                return value
+            self._count('invalidations')
+        self._count('misses')
+        return None
+
+    def set(self, key, value, watermark=None):
+        self.backend.set(key, (watermark, value), self.ttl)
+
+    def get_or_compute(self, key, compute, watermark=None):
+        value = self.get(key, watermark)
+        if value is None:
+            value = compute()
+            self.set(key, value, watermark)
+        return value
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(key)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'ttl': self.ttl,
+            }
+
+
+def result_cache_from_env(prefix, ttl=300, max_entries=1024):
+    """Build a ResultCache configured by ``<PREFIX>_CACHE_*`` environment variables"""
+    return ResultCache(
+        make_backend(
+            os.environ.get(f"{prefix}_CACHE_URL"),
+            max_entries=int(os.environ.get(f"{prefix}_CACHE_MAX_ENTRIES", max_entries)),
+            prefix=f"portal:{prefix.lower()}:",
+        ),
+        ttl=float(os.environ.get(f"{prefix}_CACHE_TTL", ttl)),
+    )
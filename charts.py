@@ -0,0 +1,354 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import analytics
+import metrics
+from cache import LRUBackend, ResultCache
+
+logger = logging.getLogger(__name__)
+
+CHART_TYPES = ('daily', 'issues', 'pie')
+
+# Bump when the rendering code changes so cached images and ETags are refreshed
+CHART_STYLE_VERSION = 2
+
+# Rendering runs in a separate process pool so CPU-bound matplotlib work
+# never holds the request worker's GIL.  0 workers renders in-process.
+POOL_WORKERS = int(os.environ.get("CHART_POOL_WORKERS", 2))
+MAX_PENDING = int(os.environ.get("CHART_POOL_MAX_PENDING", 8))
+RENDER_TIMEOUT = float(os.environ.get("CHART_RENDER_TIMEOUT", 15))
+# forkserver (where the platform has it) forks render processes from a
+# single-threaded helper that has imported FORKSERVER_PRELOAD; spawn starts
+# each one from a fresh interpreter
+START_METHOD = os.environ.get(
+    "CHART_POOL_START_METHOD",
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Imported once by the fork server, so render processes start with the
+# chart stack already loaded
+FORKSERVER_PRELOAD = ['charts', 'matplotlib', 'matplotlib.figure', 'numpy', 'pandas']
+
+
+class ChartPoolSaturated(Exception):
+    """Raised when MAX_PENDING renders are already queued or running"""
+
+
+class ChartRenderTimeout(Exception):
+    """Raised when a render does not finish within RENDER_TIMEOUT seconds"""
+
+
+class ChartPoolBroken(Exception):
+    """Raised when a render process died; the pool is replaced on the next render"""
+
+
+# Rendered PNGs are kept up to this many bytes per worker
+chart_cache = ResultCache(
+    LRUBackend(
+        max_entries=int(os.environ.get("CHART_CACHE_MAX_ENTRIES", 512)),
+        max_weight=int(os.environ.get("CHART_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+        weigh=lambda entry: len(entry[1]),
+    ),
+    ttl=float(os.environ.get("CHART_CACHE_TTL", 3600)),
+)
+
+
+def fingerprint(chart_type, location, expertise, result):
+    """Strong validator for a chart: a digest of everything the PNG is drawn from"""
+    if chart_type == 'daily':
+        data = (result.window.granularity, result.series)
+    elif chart_type == 'issues':
+        data = result.top_issues(8)
+    else:
+        data = result.issues
+    payload = repr((CHART_STYLE_VERSION, chart_type, location, expertise, data))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+_executor = None
+_executor_pid = None
+_slots = None
+_inflight = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return this process's render pool, creating it lazily (and again after a fork)"""
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    with _lock:
+        if _executor is None or _executor_pid != pid:
+            context = multiprocessing.get_context(START_METHOD)
+            if START_METHOD == 'forkserver':
+                context.set_forkserver_preload(FORKSERVER_PRELOAD)
+            _executor = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=context,
+                initializer=_init_render_process,
+            )
+            _executor_pid = pid
+            _slots = threading.BoundedSemaphore(MAX_PENDING)
+            _inflight.clear()
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _init_render_process():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def warm_up():
+    """Render each chart type once, off the request path.
+
+    Loads matplotlib, numpy and pandas, builds matplotlib's font cache and
+    exercises text layout, which is most of the cost of a process's first
+    chart.
+    """
+    _init_render_process()
+    window = analytics.resolve_window('7d')
+    result = analytics.AnalyticsResult(
+        window=window, total_count=2,
+        series=[(day, 1) for day in window.buckets], issues=[('warm_up', 1), ('warm_up_2', 1)])
+    for chart_type in CHART_TYPES:
+        render_chart(chart_type, 'warm-up', 'warm-up', result)
+
+
+def warm_pool():
+    """Start this process's render processes and warm each one up in the background"""
+    if POOL_WORKERS <= 0:
+        return []
+    executor = _get_executor()
+    return [executor.submit(warm_up) for _ in range(POOL_WORKERS)]
+
+
+def _submit(key, chart_type, location, expertise, result):
+    """Start a render or join one already running for the same key"""
+    executor = _get_executor()
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        if not _slots.acquire(blocking=False):
+            raise ChartPoolSaturated(f"{MAX_PENDING} chart renders already pending")
+        try:
+            future = executor.submit(render_chart, chart_type, location, expertise, result)
+        except Exception:
+            _slots.release()
+            raise
+        _inflight[key] = future
+        slots = _slots
+
+    def _done(finished):
+        with _lock:
+            if _inflight.get(key) is finished:
+                del _inflight[key]
+        slots.release()
+
+    future.add_done_callback(_done)
+    return future
+
+
+def get_chart_png(chart_type, location, expertise, result, etag=None):
+    """Return the PNG for a chart, rendering it only when it is not cached.
+    
+    Raises ChartPoolSaturated or ChartRenderTimeout when the render pool
+    cannot take or finish the work in time, ChartPoolBroken when a render
+    process died.
+    """
+    etag = etag or fingerprint(chart_type, location, expertise, result)
+    key = (chart_type, location, expertise, etag)
+    png = chart_cache.get(key)
+    if png is not None:
+        return png
+    
+    started = time.perf_counter()
+    if POOL_WORKERS <= 0:
+        png = render_chart(chart_type, location, expertise, result)
+    else:
+        try:
+            future = _submit(key, chart_type, location, expertise, result)
+            png = future.result(timeout=RENDER_TIMEOUT)
+        except FutureTimeout:
+            # The render keeps its slot until it actually finishes
+            raise ChartRenderTimeout(f"chart render exceeded {RENDER_TIMEOUT:.0f}s")
+        except BrokenProcessPool as e:
+            # Start a fresh pool on the next request
+            _reset_executor()
+            raise ChartPoolBroken("a chart render process died") from e
+    metrics.record_chart(chart_type, time.perf_counter() - started)
+    chart_cache.set(key, png)
+    return png
+
+
+def load_stored_png(conn, chart_type, location, expertise, window, etag):
+    """Put the nightly batch's PNG for this chart into chart_cache unless it is already there.
+
+    The stored image is only used when its fingerprint equals ``etag``, so
+    a changed CHART_STYLE_VERSION or result still renders afresh.
+    """
+    key = (chart_type, location, expertise, etag)
+    if chart_cache.backend.get(key) is not None:
+        return
+    stored = analytics.stored_artifact(conn, location, expertise, window, chart_type)
+    if stored is not None and stored[1] == etag:
+        chart_cache.set(key, stored[0])
+
+
+def pool_stats():
+    with _lock:
+        return {
+            'workers': POOL_WORKERS,
+            'max_pending': MAX_PENDING,
+            'pending': len(_inflight),
+        }
+
+
+def render_chart(chart_type, location, expertise, result):
+    """Render one of CHART_TYPES for an AnalyticsResult as PNG bytes.
+    
+    Uses the object-oriented Figure API only, never the pyplot current-figure
+    state; the style is applied as a temporary rc context.  Runs inside a
+    render pool process unless CHART_POOL_WORKERS is 0.
+    """
+    from matplotlib import style
+    from matplotlib.figure import Figure
+    
+    with style.context('dark_background'):  # Dark theme to match our application
+        fig = Figure(figsize=(10, 6))
+        _draw_chart(fig, chart_type, location, expertise, result)
+        
+        # Save plot to a buffer
+        buf = io.BytesIO()
+        fig.tight_layout()
+        fig.savefig(buf, format='png', dpi=100)
+    return buf.getvalue()
+
+
+def _draw_chart(fig, chart_type, location, expertise, result):
+    import numpy as np
+    import pandas as pd
+    from matplotlib import colormaps
+    from matplotlib.artist import setp
+    
+    ax = fig.subplots()
+
+    # The title only depends on the cache key so identical data renders identical bytes
+    title_text = f'Analytics for {expertise} - {location}'
+
+    if chart_type == 'daily':
+        # Appointment trend, one point per day, week or month
+        daily_data = result.series
+        granularity = result.window.granularity
+
+        if not any(count for _, count in daily_data):
+            ax.text(0.5, 0.5, 'No data available for the selected period', 
+                   horizontalalignment='center', verticalalignment='center')
+        else:
+            # Convert to pandas DataFrame for easier manipulation
+            dates = [day for day, _ in daily_data]
+            counts = [count for _, count in daily_data]
+
+            # Create DataFrame with explicit column names
+            df = pd.DataFrame({'date': dates, 'count': counts})
+            df['date'] = pd.to_datetime(df['date'])
+            df = df.sort_values('date')
+
+            # Plot the data
+            ax.plot(df['date'], df['count'], marker='o', linestyle='-', linewidth=2)
+            ax.set_title(f'Appointments per {granularity.capitalize()}\n{title_text}')
+            ax.set_xlabel('Date' if granularity == 'day' else f'{granularity.capitalize()} starting')
+            ax.set_ylabel('Number of Appointments')
+            ax.grid(True, alpha=0.3)
+
+            # Format x-axis to show dates properly
+            fig.autofmt_xdate()
+
+            # Add data labels while they still fit
+            for i, count in enumerate(df['count'] if len(df) <= 31 else []):
+                ax.annotate(str(count), (df['date'].iloc[i], count),
+                           textcoords="offset points", xytext=(0,5), ha='center')
+
+    elif chart_type == 'issues':
+        # Issue types distribution
+        issues_data = result.top_issues(8)
+
+        if not issues_data:
+            ax.text(0.5, 0.5, 'No data available for issue types', 
+                   horizontalalignment='center', verticalalignment='center')
+        else:
+            intents = [intent for intent, _ in issues_data]
+            counts = [count for _, count in issues_data]
+
+            # Create DataFrame with explicit column names
+            df = pd.DataFrame({'intent': intents, 'count': counts})
+
+            # Create horizontal bar chart
+            bars = ax.barh(df['intent'], df['count'], color=colormaps['viridis'](np.linspace(0, 1, len(df))))
+            ax.set_title(f'Issue Types Distribution\n{title_text}')
+            ax.set_xlabel('Number of Appointments')
+            ax.set_ylabel('Issue Type')
+
+            # Add count labels to bars
+            for bar in bars:
+                width = bar.get_width()
+                ax.annotate(f'{width}',
+                          xy=(width, bar.get_y() + bar.get_height()/2),
+                          xytext=(3, 0),  # 3 points horizontal offset
+                          textcoords="offset points",
+                          ha='left', va='center')
+
+            # Adjust layout for better display of long text
+            fig.tight_layout()
+
+    elif chart_type == 'pie':
+        # Pie chart of issue types
+        issues_data = result.issues
+
+        if not issues_data:
+            ax.text(0.5, 0.5, 'No data available for issue types', 
+                   horizontalalignment='center', verticalalignment='center')
+        else:
+            intents = [intent for intent, _ in issues_data]
+            counts = [count for _, count in issues_data]
+
+            # Create DataFrame with explicit column names
+            df = pd.DataFrame({'intent': intents, 'count': counts})
+
+            # Generate colors
+            colors = colormaps['tab10'](np.linspace(0, 1, len(df)))
+
+            # Create pie chart
+            wedges, texts, autotexts = ax.pie(
+                df['count'], 
+                labels=df['intent'],
+                autopct='%1.1f%%',
+                colors=colors,
+                shadow=True,
+                startangle=90,
+                textprops={'color': 'white'}
+            )
+
+            # Ensure pie is drawn as a circle
+            ax.axis('equal')
+            ax.set_title(f'Issue Types Distribution (Pie Chart)\n{title_text}')
+
+            # Make labels more readable
+            setp(autotexts, size=9, weight="bold")
+            setp(texts, size=8)
+
+            # Add legend for better readability with many categories
+            if len(df) > 5:
+                ax.legend(df['intent'], loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
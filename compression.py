@@ -0,0 +1,118 @@
+import logging
+import os
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are sent as is; streamed bodies are always compressed
+MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 500))
+
+# zlib level for gzip and quality for brotli; cheap settings suit per-request work
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 4))
+
+COMPRESSIBLE_TYPES = {
+    'text/html', 'text/css', 'text/csv', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+}
+
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class _Gzip:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+COMPRESSORS = {'gzip': _Gzip, 'br': _Brotli}
+
+
+def negotiate():
+    """Best encoding the client accepts (honouring q-values), or None"""
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def _compress_stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def _weaken_etag(response):
+    # The compressed body differs byte for byte, so only weak comparison holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+
+
+def compress_response(response):
+    """Encode the response body with the negotiated encoding when it is worth it.
+
+    Buffered bodies under MIN_SIZE are left alone.  Streamed bodies (CSV
+    exports) are compressed chunk by chunk as they are generated, so memory
+    stays flat; event streams are never touched.
+    """
+    if response.mimetype not in COMPRESSIBLE_TYPES and response.status_code != 304:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if 'Content-Encoding' in response.headers or response.status_code not in (200, 304):
+        return response
+    encoding = negotiate()
+    if encoding is None:
+        return response
+    if response.status_code == 304:
+        _weaken_etag(response)
+        return response
+
+    compressor = COMPRESSORS[encoding]()
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = _compress_stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        # Static files arrive as a passthrough file wrapper; read them in
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    _weaken_etag(response)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
+    logger.info("Response compression enabled: %s (min size %s bytes)", ', '.join(ENCODINGS), MIN_SIZE)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+from datetime import timezone
+from flask import Response, g, request, session
+import business_time
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _templates_digest():
+    """Digest of the template sources, so a deploy that changes markup changes every ETag"""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        with open(os.path.join(TEMPLATE_DIR, name), 'rb') as f:
+            digest.update(name.encode('utf-8') + b'\0' + f.read())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_VERSION = _templates_digest()
+
+
+def etag_for(view, fingerprint, *extra):
+    """Strong ETag for ``view`` as seen by the logged-in technician.
+
+    ``fingerprint`` identifies the data; the technician's record rendered
+    in the page (g.technician, set by login_required), the full request path
+    and the template version are mixed in so that two technicians or two
+    pages never share a tag, and a renamed or moved technician gets fresh
+    pages.
+    """
+    parts = [
+        view, TEMPLATES_VERSION, request.full_path,
+        *(g.get('technician') or ()),
+        *fingerprint, *extra,
+    ]
+    return hashlib.sha256('|'.join(map(str, parts)).encode('utf-8')).hexdigest()[:32]
+
+
+def last_modified(created_at):
+    """Aware UTC datetime for a naive storage-time created_at (None stays None)"""
+    if created_at is None:
+        return None
+    return created_at.replace(tzinfo=business_time.STORAGE_TIMEZONE).astimezone(timezone.utc)
+
+
+def is_fresh(etag, modified=None):
+    """True when the client's cached copy matches and a 304 may be sent.
+
+    Pending flash messages are rendered into the page, so their presence
+    always forces a full response.
+    """
+    if session.get('_flashes'):
+        return False
+    if request.if_none_match:
+        # Weak comparison: compressed responses carry a weakened tag
+        return request.if_none_match.contains_weak(etag)
+    if modified is not None and request.if_modified_since is not None:
+        return modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def tag(response, etag, modified=None):
+    """Attach validators to ``response``; browsers revalidate on every use"""
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(etag, modified=None):
+    return tag(Response(status=304), etag, modified)
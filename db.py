@@ -0,0 +1,683 @@
+import os
+import functools
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from flask import g, has_app_context
+import psycopg2
+import psycopg2.extensions
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+# Seconds to wait for the TCP connection and authentication
+CONNECT_TIMEOUT = _env_int('DB_CONNECT_TIMEOUT', 3)
+
+# Server-side limit on each statement of a request, in milliseconds (0 = none)
+STATEMENT_TIMEOUT = _env_int('DB_STATEMENT_TIMEOUT', 10000)
+
+# Read replicas: comma-separated URLs; read-only routes use them when set
+REPLICA_URLS = [url.strip() for url in os.environ.get(
+    'DATABASE_REPLICA_URLS', os.environ.get('DATABASE_REPLICA_URL', '')).split(',') if url.strip()]
+
+# Replicas further behind the primary than this (seconds) are skipped for reads
+REPLICA_MAX_LAG = _env_float('DB_REPLICA_MAX_LAG', 10)
+
+# How long a measured replica lag is trusted before it is queried again
+REPLICA_LAG_CHECK_INTERVAL = _env_float('DB_REPLICA_LAG_CHECK_INTERVAL', 5)
+
+# 'round_robin' or 'least_loaded' (fewest checked-out connections)
+REPLICA_SELECTION = os.environ.get('DB_REPLICA_SELECTION', 'round_robin')
+
+# Connection roles accepted by get_db_connection()
+READ, WRITE = 'read', 'write'
+
+
+def _connect_options(statement_timeout):
+    options = {
+        'connect_timeout': CONNECT_TIMEOUT,
+        # Notice a vanished server mid-query instead of waiting for the OS TCP timeout
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+    if statement_timeout:
+        options['options'] = f"-c statement_timeout={int(statement_timeout)}"
+    return options
+
+
+def connect(statement_timeout=None, database_url=None):
+    """Open a raw psycopg2 connection using DATABASE_URL or the PG* variables.
+
+    ``statement_timeout`` is in milliseconds.  The pool passes
+    STATEMENT_TIMEOUT; CLI commands and the live listener connect without one.
+    ``database_url`` overrides DATABASE_URL; replica pools pass their own.
+    """
+    options = _connect_options(statement_timeout)
+
+    # First try to use DATABASE_URL (common in Railway, Heroku, Render)
+    database_url = database_url or os.environ.get("DATABASE_URL")
+
+    if database_url:
+        # Handle Heroku's postgres:// vs postgresql:// issue
+        if database_url.startswith("postgres://"):
+            database_url = database_url.replace("postgres://", "postgresql://", 1)
+
+        conn = psycopg2.connect(database_url, **options)
+        conn.autocommit = True
+        return conn
+
+    # Fall back to individual parameters
+    conn = psycopg2.connect(
+        host=os.environ.get("PGHOST", "localhost"),
+        dbname=os.environ.get("PGDATABASE", "utilities_db"),
+        user=os.environ.get("PGUSER", "utilities_user"),
+        password=os.environ.get("PGPASSWORD", "securepassword"),
+        port=os.environ.get("PGPORT", "5432"),
+        **options
+    )
+    conn.autocommit = True
+    return conn
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout"""
+
+
+class CircuitBreaker:
+    """Stops requests from waiting on a database that keeps failing.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow()`` refuses immediately.  Once ``reset_timeout`` seconds have
+    passed, one trial request is let through (half-open): its success closes
+    the breaker, its failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_started = 0.0
+        self._trips = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_started = now
+                return True
+            if self.state == self.HALF_OPEN and now - self._trial_started >= self.reset_timeout:
+                # The previous trial never reported back; try again
+                self._trial_started = now
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Database circuit closed")
+            self.state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self._failures >= self.failure_threshold):
+                logger.warning("Database circuit opened after %s consecutive failures", self._failures)
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trips += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self._failures,
+                'trips': self._trips,
+                'rejected': self._rejected,
+            }
+
+
+# Failures that say the database is unreachable or overloaded (connection
+# loss, statement timeout), as opposed to errors in a query
+_AVAILABILITY_ERRORS = (psycopg2.OperationalError, PoolTimeout)
+
+breaker = CircuitBreaker(
+    failure_threshold=_env_int('DB_BREAKER_THRESHOLD', 5),
+    reset_timeout=_env_float('DB_BREAKER_RESET_TIMEOUT', 30),
+)
+
+
+class _Slot:
+    """Bookkeeping for one physical connection owned by the pool"""
+
+    __slots__ = ('conn', 'created_at', 'returned_at')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.returned_at = now
+
+
+class TimedCursor:
+    """Cursor proxy that reports every server round trip to the request metrics"""
+
+    _ROUND_TRIPS = frozenset(['execute', 'executemany', 'callproc', 'copy_expert', 'copy_from', 'copy_to'])
+    _FETCHES = frozenset(['fetchone', 'fetchmany', 'fetchall'])
+
+    def __init__(self, cursor, breaker):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_breaker', breaker)
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name in self._ROUND_TRIPS or (name in self._FETCHES and self._cursor.name):
+            counts = 1 if name in self._ROUND_TRIPS else 0
+
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = attr(*args, **kwargs)
+                except psycopg2.OperationalError:
+                    self._breaker.record_failure()
+                    raise
+                finally:
+                    metrics.record_query(time.perf_counter() - started, counts)
+                self._breaker.record_success()
+                return result
+            return timed
+        return attr
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._cursor.__exit__(exc_type, exc, tb)
+
+
+class PooledConnection:
+    """Proxy around a pooled connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, slot):
+        self._pool = pool
+        self._slot = slot
+
+    def __getattr__(self, name):
+        if self._slot is None:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+        return getattr(self._slot.conn, name)
+
+    @property
+    def closed(self):
+        return 1 if self._slot is None else self._slot.conn.closed
+
+    # Assignments must reach the real connection; release() restores autocommit
+    @property
+    def autocommit(self):
+        return self.__getattr__('autocommit')
+
+    @autocommit.setter
+    def autocommit(self, value):
+        if self._slot is None:
+            raise psycopg2.InterfaceError('connection already returned to the pool')
+        self._slot.conn.autocommit = value
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self.__getattr__('cursor')(*args, **kwargs), self._pool.breaker)
+
+    def close(self):
+        if self._slot is not None:
+            slot, self._slot = self._slot, None
+            self._pool.release(slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections.
+
+    Idle connections are validated with ``SELECT 1`` before reuse once they
+    have been idle longer than ``validate_after`` seconds, and are recycled
+    after ``max_lifetime`` seconds.  Checkout blocks for at most ``timeout``
+    seconds when all ``max_size`` connections are in use.  Query failures on
+    its connections are reported to ``breaker``.
+    """
+
+    def __init__(self, connect_fn=connect, min_size=1, max_size=10, timeout=5.0,
+                 validate_after=30.0, max_lifetime=1800.0, breaker=breaker):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('invalid pool size: min=%s max=%s' % (min_size, max_size))
+        self._connect = connect_fn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.max_lifetime = max_lifetime
+        self.breaker = breaker
+
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Sizing statistics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+        self._discarded = 0
+
+        for _ in range(min_size):
+            try:
+                self._idle.append(_Slot(self._connect()))
+            except Exception as e:
+                logger.warning("Could not pre-open pooled connection: %s", e)
+                break
+
+    @property
+    def size(self):
+        return len(self._idle) + self._in_use
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        with self._cond:
+            while not self._idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(
+                        f"no database connection available after {timeout:.1f}s "
+                        f"({self._in_use} in use)")
+                waited = True
+                self._cond.wait(remaining)
+            slot = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        if slot is not None:
+            slot = self._validate(slot)
+        if slot is None:
+            try:
+                slot = _Slot(self._connect())
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += elapsed
+                self._max_wait = max(self._max_wait, elapsed)
+        return PooledConnection(self, slot)
+
+    def _validate(self, slot):
+        """Return ``slot`` if it is still usable, otherwise close it and return None"""
+        now = time.monotonic()
+        conn = slot.conn
+        healthy = not conn.closed and now - slot.created_at < self.max_lifetime
+        if healthy and now - slot.returned_at > self.validate_after:
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT 1')
+                cur.close()
+            except Exception as e:
+                logger.info("Discarding stale pooled connection: %s", e)
+                healthy = False
+        if healthy:
+            return slot
+        self._discard(conn)
+        return None
+
+    def _discard(self, conn):
+        with self._cond:
+            self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def release(self, slot):
+        conn = slot.conn
+        reusable = not conn.closed
+        if reusable:
+            try:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    reusable = False
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if reusable and not conn.autocommit:
+                    conn.autocommit = True
+            except Exception as e:
+                logger.info("Discarding pooled connection on return: %s", e)
+                reusable = False
+        if not reusable:
+            self._discard(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                slot.returned_at = time.monotonic()
+                self._idle.append(slot)
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for slot in idle:
+            try:
+                slot.conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait, 6),
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+            }
+
+
+class Replica:
+    """A read replica: its own pool and circuit breaker, plus its last measured lag"""
+
+    # Seconds behind the primary; 0 when fully replayed or not in recovery at
+    # all (a standalone copy, as in local testing), NULL when unknown
+    LAG_SQL = """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """
+
+    def __init__(self, name, database_url):
+        self.name = name
+        self.database_url = database_url
+        self.breaker = CircuitBreaker(
+            failure_threshold=_env_int('DB_BREAKER_THRESHOLD', 5),
+            reset_timeout=_env_float('DB_BREAKER_RESET_TIMEOUT', 30),
+        )
+        self.lag = None
+        self._lag_checked_at = None
+        self._lock = threading.Lock()
+
+    def usable(self, conn):
+        """Whether reads may go to this replica, re-measuring its lag on ``conn`` when due"""
+        now = time.monotonic()
+        with self._lock:
+            due = self._lag_checked_at is None or now - self._lag_checked_at >= REPLICA_LAG_CHECK_INTERVAL
+            if due:
+                # Claim the check so concurrent requests keep using the last value
+                self._lag_checked_at = now
+        if due:
+            try:
+                cur = conn.cursor()
+                cur.execute(self.LAG_SQL)
+                lag = cur.fetchone()[0]
+                cur.close()
+                lag = None if lag is None else max(0.0, float(lag))
+            except psycopg2.Error as e:
+                logger.warning("Could not measure lag of %s: %s", self.name, e)
+                lag = None
+            if lag is None or lag > REPLICA_MAX_LAG:
+                behind = 'unknown' if lag is None else f"{lag:.1f}s"
+                logger.warning("Replica %s lag %s (limit %ss), not reading from it", self.name, behind, REPLICA_MAX_LAG)
+            self.lag = lag
+        return self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    def stats(self):
+        return {
+            'lag_seconds': self.lag,
+            'circuit': self.breaker.stats(),
+            'pool': pool_stats(self.name),
+        }
+
+
+PRIMARY = 'primary'
+
+replicas = [Replica(f'replica{i}', url) for i, url in enumerate(REPLICA_URLS)]
+
+_pools = {}
+_pools_pid = None
+_pool_lock = threading.Lock()
+_replica_turn = itertools.count()
+_reads = {'replica': 0, 'primary': 0}
+_reads_lock = threading.Lock()
+
+
+def _new_pool(name):
+    replica = next((r for r in replicas if r.name == name), None)
+    if replica is None:
+        connect_fn = functools.partial(connect, statement_timeout=STATEMENT_TIMEOUT)
+        circuit = breaker
+    else:
+        connect_fn = functools.partial(connect, statement_timeout=STATEMENT_TIMEOUT,
+                                       database_url=replica.database_url)
+        circuit = replica.breaker
+    return ConnectionPool(
+        connect_fn=connect_fn,
+        min_size=_env_int('DB_POOL_MIN_SIZE', 1),
+        max_size=_env_int('DB_POOL_MAX_SIZE', 10),
+        timeout=_env_float('DB_POOL_TIMEOUT', 5),
+        validate_after=_env_float('DB_POOL_VALIDATE_AFTER', 30),
+        max_lifetime=_env_float('DB_POOL_MAX_LIFETIME', 1800),
+        breaker=circuit,
+    )
+
+
+def get_pool(name=PRIMARY):
+    """Return this process's pool for the primary or a named replica.
+
+    Pools are created lazily, and again after a fork.
+    """
+    global _pools, _pools_pid
+    pid = os.getpid()
+    pool = _pools.get(name) if _pools_pid == pid else None
+    if pool is None:
+        with _pool_lock:
+            if _pools_pid != pid:
+                # Connections inherited from a parent process must not be reused
+                _pools, _pools_pid = {}, pid
+            pool = _pools.get(name)
+            if pool is None:
+                pool = _pools[name] = _new_pool(name)
+    return pool
+
+
+def _replica_order():
+    """Replicas in the order reads should try them"""
+    if REPLICA_SELECTION == 'least_loaded':
+        return sorted(replicas, key=lambda r: pool_stats(r.name).get('in_use', 0))
+    start = next(_replica_turn) % len(replicas)
+    return replicas[start:] + replicas[:start]
+
+
+def _replica_connection():
+    """A connection to a healthy replica within REPLICA_MAX_LAG, or None"""
+    for replica in _replica_order():
+        if not replica.breaker.allow():
+            continue
+        try:
+            conn = get_pool(replica.name).getconn()
+        except Exception as e:
+            if isinstance(e, _AVAILABILITY_ERRORS):
+                replica.breaker.record_failure()
+            logger.warning("Replica %s connection error: %s", replica.name, e)
+            continue
+        if replica.usable(conn):
+            return conn
+        conn.close()
+    return None
+
+
+def _count_read(target):
+    with _reads_lock:
+        _reads[target] += 1
+
+
+def get_db_connection(role=WRITE):
+    """Check a connection out of the pool, or return None if none is available.
+
+    ``role='read'`` is for routes that only read: it returns a replica
+    connection when replicas are configured, healthy and within
+    REPLICA_MAX_LAG, and a primary connection otherwise.
+
+    Inside a request the connection is tracked on ``flask.g`` and returned to
+    the pool on teardown, so early returns and exceptions cannot leak it.
+    Calling ``close()`` on it returns it to the pool immediately.
+
+    While the circuit breaker is open this returns None at once instead of
+    waiting for connect or pool timeouts.
+    """
+    if role not in (READ, WRITE):
+        raise ValueError(f"unknown connection role {role!r}")
+    conn = _replica_connection() if role == READ and replicas else None
+    if conn is None:
+        if not breaker.allow():
+            logger.info("Database circuit open, not attempting a connection")
+            return None
+        try:
+            conn = get_pool().getconn()
+        except Exception as e:
+            if isinstance(e, _AVAILABILITY_ERRORS):
+                breaker.record_failure()
+            logger.error("Database connection error: %s", e)
+            return None
+        if role == READ:
+            _count_read('primary')
+    else:
+        _count_read('replica')
+
+    if has_app_context():
+        g.setdefault('_db_connections', []).append(conn)
+    return conn
+
+
+def pool_stats(name=PRIMARY):
+    pool = _pools.get(name) if _pools_pid == os.getpid() else None
+    return pool.stats() if pool is not None else {}
+
+
+def replica_stats():
+    with _reads_lock:
+        reads = dict(_reads)
+    return {
+        'selection': REPLICA_SELECTION,
+        'max_lag_seconds': REPLICA_MAX_LAG,
+        'reads': reads,
+        'replicas': {replica.name: replica.stats() for replica in replicas},
+    }
+
+
+def _pool_names():
+    return [PRIMARY] + [replica.name for replica in replicas]
+
+
+@metrics.register_collector
+def _pool_metrics():
+    samples = []
+    for name in _pool_names():
+        stats = pool_stats(name)
+        samples.append(({'pool': name, 'state': 'in_use'}, stats.get('in_use', 0)))
+        samples.append(({'pool': name, 'state': 'idle'}, stats.get('idle', 0)))
+    return ('portal_db_pool_connections', 'gauge', 'Pooled database connections by state', samples)
+
+
+@metrics.register_collector
+def _pool_wait_metrics():
+    return ('portal_db_pool_wait_seconds_total', 'counter', 'Time requests spent waiting for a connection',
+            [({'pool': name}, pool_stats(name).get('wait_time_total', 0.0)) for name in _pool_names()])
+
+
+@metrics.register_collector
+def _pool_timeout_metrics():
+    return ('portal_db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection',
+            [({'pool': name}, pool_stats(name).get('timeouts', 0)) for name in _pool_names()])
+
+
+@metrics.register_collector
+def _breaker_metrics():
+    stats = breaker.stats()
+    return ('portal_db_circuit_open', 'gauge', 'Whether the database circuit breaker is refusing requests',
+            [({}, 0 if stats['state'] == CircuitBreaker.CLOSED else 1)])
+
+
+@metrics.register_collector
+def _breaker_rejected_metrics():
+    return ('portal_db_circuit_rejected_total', 'counter', 'Requests refused by the open circuit breaker',
+            [({}, breaker.stats()['rejected'])])
+
+
+@metrics.register_collector
+def _read_route_metrics():
+    with _reads_lock:
+        reads = dict(_reads)
+    return ('portal_db_reads_total', 'counter', 'Read-role checkouts by the server that served them',
+            [({'target': target}, count) for target, count in reads.items()])
+
+
+@metrics.register_collector
+def _replica_lag_metrics():
+    # -1 while a replica's lag is unknown
+    return ('portal_db_replica_lag_seconds', 'gauge', 'Last measured replication lag of each replica',
+            [({'replica': r.name}, -1 if r.lag is None else r.lag) for r in replicas])
+
+
+def _release_request_connections(exc=None):
+    for conn in g.pop('_db_connections', []):
+        conn.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(_release_request_connections)
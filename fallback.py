@@ -0,0 +1,17 @@
+from datetime import datetime
+import business_time
+from cache import result_cache_from_env
+
+# Last successfully rendered data of each page, kept for serving while the
+# database is unavailable.  Configured by STALE_CACHE_* like the other caches.
+last_good = result_cache_from_env('STALE', ttl=86400, max_entries=1024)
+
+
+def remember(view, key, context):
+    """Store the template context of a page rendered from fresh data"""
+    last_good.set((view,) + tuple(key), (datetime.now(business_time.BUSINESS_TIMEZONE), context))
+
+
+def recall(view, key):
+    """Return (stored_at, context) of the last good render of a page, or None"""
+    return last_good.get((view,) + tuple(key))
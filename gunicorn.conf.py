@@ -0,0 +1,29 @@
+# gunicorn reads this file from the working directory on start-up.
+# Command-line flags override it; the worker count follows WEB_CONCURRENCY.
+import os
+
+# Threaded workers, so open live-dashboard streams do not block a worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Import the app and compile the templates once in the master and
+# fork workers from it (warmup.preload); GUNICORN_PRELOAD=false loads the app
+# separately in each worker instead
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before the first fork
+    if server.cfg.preload_app:
+        import warmup
+        from main import app
+        warmup.preload(app)
+
+
+def post_worker_init(worker):
+    # Runs in each worker once the app is loaded, before it accepts requests
+    import sessions
+    import warmup
+    # Covers --workers as well as WEB_CONCURRENCY, which sessions.init_app checks
+    sessions.check_store(worker.wsgi, worker.cfg.workers)
+    warmup.after_fork()
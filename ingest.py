@@ -0,0 +1,197 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+import business_time
+
+logger = logging.getLogger(__name__)
+
+# Rows validated and loaded per COPY + INSERT transaction
+BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 5000))
+
+# Bearer token required by POST /api/appointments/ingest; unset disables it
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+# Longest accepted value of any text field
+MAX_FIELD_LENGTH = 2000
+
+TEXT_FIELDS = ('intent', 'name', 'problem_description', 'location', 'contact', 'time_slot')
+REQUIRED_FIELDS = ('intent', 'location', 'created_at')
+COLUMNS = TEXT_FIELDS + ('created_at', 'source_key')
+
+_WHITESPACE = re.compile(r'\s+')
+
+IngestResult = namedtuple('IngestResult', ['read', 'inserted', 'duplicates', 'rejected'])
+
+
+class RejectedRow(ValueError):
+    """Raised by normalize() for a record that cannot be loaded"""
+
+
+def read_jsonl(stream):
+    """Yield (line_number, record) from a text stream of JSON objects, one per line"""
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, RejectedRow(f"invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield line_number, RejectedRow('expected a JSON object')
+            continue
+        yield line_number, record
+
+
+def read_csv(stream):
+    """Yield (line_number, record) from a text stream of CSV with a header row"""
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+
+def parse_created_at(value):
+    """Naive storage-time datetime from an ISO 8601 string.
+
+    Values with an offset are converted to the storage timezone; naive
+    values are taken to be in storage time already, as in a table dump.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).strip())
+        except ValueError:
+            raise RejectedRow(f"unparseable created_at {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = business_time.to_storage(parsed)
+    return parsed
+
+
+def _clean(field, value):
+    if value is None:
+        return None
+    value = _WHITESPACE.sub(' ', str(value)).strip()
+    if '\x00' in value:
+        raise RejectedRow(f"{field} contains a NUL character")
+    if len(value) > MAX_FIELD_LENGTH:
+        raise RejectedRow(f"{field} longer than {MAX_FIELD_LENGTH} characters")
+    return value or None
+
+
+def natural_key(row):
+    """Stable key of a normalized row, used to skip rows loaded by an earlier run"""
+    parts = [row['created_at'].isoformat()] + [row[field] or '' for field in TEXT_FIELDS]
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def normalize(record):
+    """Validate one input record and return the dict of columns to load.
+
+    Text fields are whitespace-collapsed, ``created_at`` is converted to
+    storage time and ``source_key`` is taken from the record (``source_key``
+    or ``external_id``) or derived from the other columns.
+    """
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise RejectedRow(f"missing {', '.join(missing)}")
+    row = {field: _clean(field, record.get(field)) for field in TEXT_FIELDS}
+    if row['intent'] is None or row['location'] is None:
+        raise RejectedRow('missing intent or location')
+    row['created_at'] = parse_created_at(record['created_at'])
+    source_key = record.get('source_key') or record.get('external_id')
+    row['source_key'] = _clean('source_key', source_key) if source_key not in (None, '') else natural_key(row)
+    return row
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def load_batch(conn, rows):
+    """COPY ``rows`` into a staging table and insert the new ones; return the inserted count.
+
+    Each batch is its own transaction, so an interrupted run can simply be
+    repeated: rows whose source_key is already present are skipped.
+    """
+    buffer = io.StringIO()
+    for position, row in enumerate(rows):
+        buffer.write('\t'.join([str(position)] + [_copy_value(row[column]) for column in COLUMNS]))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    columns = ', '.join(COLUMNS)
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    try:
+        cur.execute("""
+            CREATE TEMP TABLE appointments_ingest (
+                position INTEGER,
+                intent TEXT, name TEXT, problem_description TEXT, location TEXT,
+                contact TEXT, time_slot TEXT, created_at TIMESTAMP, source_key TEXT
+            ) ON COMMIT DROP
+        """)
+        cur.copy_expert(f"COPY appointments_ingest (position, {columns}) FROM STDIN", buffer)
+        # One INSERT per batch, so the rollup and notify triggers fire once
+        cur.execute(f"""
+            INSERT INTO appointments ({columns})
+            SELECT {columns} FROM appointments_ingest ORDER BY position
+            ON CONFLICT (source_key) DO NOTHING
+        """)
+        inserted = cur.rowcount
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.close()
+    return inserted
+
+
+def ingest(conn, records, batch_size=BATCH_SIZE, on_reject=None):
+    """Load ``(line_number, record)`` pairs in batches and return an IngestResult.
+
+    ``on_reject(line_number, reason, record)`` is called for every record that
+    fails validation; such records are skipped.  ``conn`` must be in
+    autocommit mode.
+    """
+    read = inserted = rejected = 0
+    batch = []
+    for line_number, record in records:
+        read += 1
+        try:
+            if isinstance(record, RejectedRow):
+                raise record
+            batch.append(normalize(record))
+        except RejectedRow as e:
+            rejected += 1
+            if on_reject is not None:
+                on_reject(line_number, str(e), None if isinstance(record, RejectedRow) else record)
+            continue
+        if len(batch) >= batch_size:
+            inserted += load_batch(conn, batch)
+            batch = []
+    if batch:
+        inserted += load_batch(conn, batch)
+    result = IngestResult(read, inserted, read - rejected - inserted, rejected)
+    logger.info("Ingested appointments: %s", result)
+    return result
+
+
+def reader_for(fmt, stream):
+    if fmt == 'jsonl':
+        return read_jsonl(stream)
+    if fmt == 'csv':
+        return read_csv(stream)
+    raise ValueError(f"unsupported format {fmt!r}")
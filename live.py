@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import queue
+import re
+import select
+import threading
+import time
+from collections import deque
+import business_time
+import db
+import models
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'appointments_inserted'
+
+# Request threads per worker (gunicorn.conf.py).  An open stream holds one
+# for up to STREAM_LIFETIME, so streams get at most half of them by default
+# and never all but two; further subscribers get 503
+WORKER_THREADS = int(os.environ.get("GUNICORN_THREADS", 8))
+MAX_SUBSCRIBERS = max(0, min(int(os.environ.get("LIVE_MAX_SUBSCRIBERS", WORKER_THREADS // 2)),
+                             WORKER_THREADS - 2))
+
+# Seconds between keep-alive comments, and before a stream is closed so the
+# browser reconnects (EventSource does this automatically)
+HEARTBEAT_INTERVAL = float(os.environ.get("LIVE_HEARTBEAT_INTERVAL", 15))
+STREAM_LIFETIME = float(os.environ.get("LIVE_STREAM_LIFETIME", 300))
+
+# Events buffered for a slow subscriber before it is disconnected
+SUBSCRIBER_QUEUE_SIZE = 100
+
+_CLOSED = object()
+
+
+class TooManySubscribers(Exception):
+    """Raised when the worker already serves MAX_SUBSCRIBERS event streams"""
+
+
+def like_matcher(pattern):
+    """Compile a SQL LIKE pattern into a predicate with the same semantics"""
+    regex = ''.join(
+        '.*' if ch == '%' else '.' if ch == '_' else re.escape(ch)
+        for ch in pattern)
+    compiled = re.compile(regex, re.DOTALL)
+    return lambda value: value is not None and compiled.fullmatch(value) is not None
+
+
+class Subscription:
+    """One open event stream for a technician's (location, expertise)"""
+
+    def __init__(self, broadcaster, location, expertise):
+        self.broadcaster = broadcaster
+        self.location = location
+        self.matches = like_matcher(f"%{expertise}%")
+        self.events = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+            return True
+        except queue.Full:
+            return False
+
+
+class AppointmentBroadcaster:
+    """Fans appointment inserts out to event streams of one worker process.
+
+    A single background thread holds one dedicated connection that LISTENs on
+    CHANNEL.  Each notification names the id range of an INSERT statement;
+    the rows in that range created today are loaded once and pushed to every
+    subscription whose location and expertise match.
+    """
+
+    def __init__(self, connect_fn=db.connect):
+        self._connect = connect_fn
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._recent_ids = deque(maxlen=10000)
+        self._recent_set = set()
+
+    def subscribe(self, location, expertise):
+        with self._lock:
+            if sum(len(subs) for subs in self._subscriptions.values()) >= MAX_SUBSCRIBERS:
+                raise TooManySubscribers(f"{MAX_SUBSCRIBERS} live dashboard streams already open")
+            subscription = Subscription(self, location, expertise)
+            self._subscriptions.setdefault(location, set()).add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='appointment-listener', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.location)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscriptions[subscription.location]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscriptions.values())
+
+    def _run(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CHANNEL}")
+                backoff = 1
+                logger.info("Listening for %s notifications", CHANNEL)
+                while True:
+                    if select.select([conn], [], [], HEARTBEAT_INTERVAL) == ([], [], []):
+                        continue
+                    conn.poll()
+                    ranges = []
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            payload = json.loads(notify.payload)
+                            ranges.append((int(payload['first_id']), int(payload['last_id'])))
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning("Ignoring malformed %s payload: %r", CHANNEL, notify.payload)
+                    if ranges:
+                        self._dispatch(conn, ranges)
+            except Exception as e:
+                logger.warning("Appointment listener failed, reconnecting in %ss: %s", backoff, e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _dispatch(self, conn, ranges):
+        with self._lock:
+            locations = list(self._subscriptions)
+        if not locations:
+            return
+
+        day_start, day_end = business_time.day_range()
+        for first_id, last_id in ranges:
+            for appointment in models.appointments_in_id_range(conn, first_id, last_id, locations, day_start, day_end):
+                if appointment.id in self._recent_set:
+                    continue
+                self._remember(appointment.id)
+                self._publish(models.appointment_to_json(appointment))
+
+    def _remember(self, appointment_id):
+        if len(self._recent_ids) == self._recent_ids.maxlen:
+            self._recent_set.discard(self._recent_ids[0])
+        self._recent_ids.append(appointment_id)
+        self._recent_set.add(appointment_id)
+
+    def _publish(self, appointment):
+        with self._lock:
+            subs = list(self._subscriptions.get(appointment['location'], ()))
+        for subscription in subs:
+            if subscription.matches(appointment['intent']) and not subscription.push(appointment):
+                # Too far behind: close the stream and let the browser reconnect
+                self.unsubscribe(subscription)
+                subscription.events.queue.clear()
+                subscription.push(_CLOSED)
+
+
+_broadcaster = None
+_broadcaster_pid = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    """Return this process's broadcaster, creating it lazily (and again after a fork)"""
+    global _broadcaster, _broadcaster_pid
+    pid = os.getpid()
+    with _broadcaster_lock:
+        if _broadcaster is None or _broadcaster_pid != pid:
+            _broadcaster = AppointmentBroadcaster()
+            _broadcaster_pid = pid
+        return _broadcaster
+
+
+def event_stream(subscription):
+    """Yield server-sent events for a subscription until its lifetime ends"""
+    deadline = time.monotonic() + STREAM_LIFETIME
+    try:
+        yield f"retry: {int(HEARTBEAT_INTERVAL * 1000)}\n\n"
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = subscription.events.get(timeout=min(HEARTBEAT_INTERVAL, remaining))
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event is _CLOSED:
+                return
+            yield f"event: appointment\nid: {event['id']}\ndata: {json.dumps(event)}\n\n"
+    finally:
+        subscription.broadcaster.unsubscribe(subscription)
@@ -0,0 +1,194 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import g, has_request_context, request
+import metrics
+
+# Root level, plus per-logger overrides such as "werkzeug=WARNING,db=DEBUG"
+LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOGGER_LEVELS = os.environ.get("LOG_LEVELS", "")
+
+# 'json' (one object per line) or 'text' for local development
+FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+
+# Records buffered for the writer thread; beyond this they are dropped, never waited for
+QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+# Share of requests per endpoint whose records below WARNING are kept;
+# endpoints not listed keep everything.  Warnings and errors are never sampled.
+# Dropped records are never formatted as long as callers pass %-style
+# arguments instead of f-strings.
+SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "dashboard=0.1,history=0.1,history_api=0.1")
+
+# Incoming X-Request-ID values are reused when they look like an id
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+_REQUEST_FIELDS = ('request_id', 'endpoint', 'method', 'path')
+
+
+def _parse_pairs(value, convert):
+    pairs = {}
+    for item in value.split(','):
+        name, _, setting = item.partition('=')
+        if name.strip() and setting.strip():
+            pairs[name.strip()] = convert(setting.strip())
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request fields when there are any"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        for field in _REQUEST_FIELDS:
+            value = getattr(record, field, None)
+            if value:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not getattr(record, 'request_id', None):
+            record.request_id = '-'
+        return super().format(record)
+
+
+class RequestFilter(logging.Filter):
+    """Tags records with the current request and drops those of unsampled requests.
+
+    Runs in the thread that logs, before the record is queued, while the
+    request context is still available.
+    """
+
+    def filter(self, record):
+        if not has_request_context():
+            return True
+        if record.levelno < logging.WARNING and not g.get('_log_sampled', True):
+            return False
+        record.request_id = g.get('request_id')
+        record.endpoint = request.endpoint
+        record.method = request.method
+        record.path = request.path
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of raising or waiting"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Merge the arguments now and keep the traceback as text; the writer
+        # thread formats the rest
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+
+def _output_handler():
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter() if FORMAT == 'json' else TextFormatter())
+    return handler
+
+
+def _start_listener():
+    """Point the queue handler at a fresh queue and start a writer thread for it"""
+    global _listener
+    _handler.queue = queue.Queue(QUEUE_SIZE)
+    _listener = QueueListener(_handler.queue, _output_handler())
+    _listener.start()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure():
+    """Route all logging through a bounded queue to a background writer thread.
+
+    Safe to call more than once.  Forked processes (gunicorn workers) start
+    their own writer thread, since threads do not survive a fork.
+    """
+    global _handler
+    with _lock:
+        if _handler is not None:
+            return
+        _handler = NonBlockingQueueHandler(None)
+        _handler.addFilter(RequestFilter())
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(LEVEL)
+        for name, level in _parse_pairs(LOGGER_LEVELS, str.upper).items():
+            logging.getLogger(name).setLevel(level)
+        _start_listener()
+        atexit.register(_stop_listener)
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+_sample_rates = _parse_pairs(SAMPLE_RATES, float)
+
+
+def _start_request():
+    incoming = request.headers.get('X-Request-ID', '')
+    g.request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+    rate = _sample_rates.get(request.endpoint)
+    g._log_sampled = rate is None or random.random() < rate
+
+
+def _finish_request(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+
+@metrics.register_collector
+def _dropped_metrics():
+    return ('portal_log_records_dropped_total', 'counter', 'Log records dropped because the queue was full',
+            [({}, _handler.dropped if _handler is not None else 0)])
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,176 @@
+import bisect
+import os
+import threading
+import time
+from flask import g, has_request_context, request, template_rendered, before_render_template
+
+# Add a Server-Timing header to every response (visible in browser dev tools)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+
+# Optional bearer token required to read /metrics
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(counts), count, total)
+                     for labels, (counts, count, total) in sorted(self._series.items())]
+        for labels, counts, count, total in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                label_str = _format_labels(self.labelnames + ('le',), labels + (bound,))
+                lines.append(f"{self.name}_bucket{label_str} {cumulative}")
+            label_str = _format_labels(self.labelnames + ('le',), labels + ('+Inf',))
+            lines.append(f"{self.name}_bucket{label_str} {count}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {total:.6f}")
+            lines.append(f"{self.name}_count{label_str} {count}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    'portal_http_request_duration_seconds', 'Time to produce a response',
+    ('endpoint', 'method', 'status'))
+REQUEST_DB_QUERIES = Histogram(
+    'portal_db_queries_per_request', 'Database statements executed per request',
+    ('endpoint',), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram(
+    'portal_db_time_per_request_seconds', 'Time spent in database calls per request',
+    ('endpoint',))
+TEMPLATE_RENDER = Histogram(
+    'portal_template_render_seconds', 'Jinja template render time', ('template',))
+CHART_RENDER = Histogram(
+    'portal_chart_render_seconds', 'Time to obtain a rendered chart, including pool wait',
+    ('chart_type',))
+
+HISTOGRAMS = [REQUEST_LATENCY, REQUEST_DB_QUERIES, REQUEST_DB_TIME, TEMPLATE_RENDER, CHART_RENDER]
+
+# Callables returning (name, type, documentation, [(labels_dict, value), ...])
+_collectors = []
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def _timings():
+    if not has_request_context():
+        return None
+    timings = g.get('_timings')
+    if timings is None:
+        timings = g._timings = {'db_count': 0, 'db': 0.0, 'tpl': 0.0, 'chart': 0.0}
+    return timings
+
+
+def record_query(seconds, statements=1):
+    """Called by db.py for every cursor round trip"""
+    timings = _timings()
+    if timings is not None:
+        timings['db_count'] += statements
+        timings['db'] += seconds
+
+
+def record_chart(chart_type, seconds):
+    CHART_RENDER.observe(seconds, chart_type)
+    timings = _timings()
+    if timings is not None:
+        timings['chart'] += seconds
+
+
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g._template_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    started = g.pop('_template_started', None) if has_request_context() else None
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    TEMPLATE_RENDER.observe(elapsed, template.name or '<string>')
+    _timings()['tpl'] += elapsed
+
+
+def _start_request():
+    g._request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.get('_request_started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unmatched'
+    timings = _timings()
+    REQUEST_LATENCY.observe(elapsed, endpoint, request.method, str(response.status_code))
+    REQUEST_DB_QUERIES.observe(timings['db_count'], endpoint)
+    REQUEST_DB_TIME.observe(timings['db'], endpoint)
+
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={timings["db"] * 1000:.1f};desc="{timings["db_count"]} queries"',
+            f'tpl;dur={timings["tpl"] * 1000:.1f}',
+            f'chart;dur={timings["chart"] * 1000:.1f}',
+            f'total;dur={elapsed * 1000:.1f}',
+        ])
+    return response
+
+
+def render_metrics():
+    """All metrics of this process in Prometheus text format"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.collect())
+    for collector in _collectors:
+        name, metric_type, documentation, samples = collector()
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            label_str = _format_labels(tuple(labels), tuple(labels.values()))
+            lines.append(f"{name}{label_str} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
@@ -1,8 +1,10 @@
-# This file would normally define SQLAlchemy models,
-# but since we're using direct psycopg2 connections to an existing database,
-# we don't need to define models in this implementation.
-# 
-# The existing tables in the PostgreSQL database are:
+# We use direct psycopg2 connections to an existing PostgreSQL database rather
+# than SQLAlchemy models.  The schema is managed by the versioned migrations
+# below; apply pending ones with:
+#
+#     flask --app main migrate
+#
+# The base tables are:
 #
 # CREATE TABLE appointments (
 #     id SERIAL PRIMARY KEY,
@@ -24,3 +26,665 @@
 #     email TEXT NOT NULL,
 #     password TEXT NOT NULL
 # );
+
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# ``concurrent`` migrations run outside a transaction so that
+# CREATE INDEX CONCURRENTLY can build without blocking writers.  If such a
+# build is interrupted, drop the INVALID index it leaves behind and re-run.
+Migration = namedtuple('Migration', ['version', 'description', 'statements', 'concurrent'])
+
+# Recompute the rollup tables from scratch.  Writers are blocked for the
+# duration so the triggers and the rebuild cannot double-count; readers keep
+# seeing the previous counts until the transaction commits.
+ROLLUP_REBUILD_STATEMENTS = [
+    "LOCK TABLE appointments IN SHARE ROW EXCLUSIVE MODE",
+    "DELETE FROM appointment_daily_rollup",
+    "DELETE FROM appointment_intent_totals",
+    """
+    INSERT INTO appointment_daily_rollup (day, location, intent, count)
+    SELECT DATE(a.created_at AT TIME ZONE c.storage_tz AT TIME ZONE c.business_tz),
+           a.location, a.intent, COUNT(*)
+    FROM appointments a CROSS JOIN appointment_rollup_config c
+    WHERE a.location IS NOT NULL AND a.intent IS NOT NULL AND a.created_at IS NOT NULL
+    GROUP BY 1, 2, 3
+    """,
+    """
+    INSERT INTO appointment_intent_totals (location, intent, count)
+    SELECT location, intent, SUM(count) FROM appointment_daily_rollup GROUP BY 1, 2
+    """,
+    "UPDATE appointment_rollup_config SET rebuilt_at = NOW()",
+]
+
+# Full-text document of an appointment: client name and issue type are
+# matched as written ('simple'), the problem description with English
+# stemming.  ``{row}`` is NEW. in the trigger and empty in the backfill.
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('simple', coalesce({row}name, '')), 'A') ||
+    setweight(to_tsvector('simple', replace(coalesce({row}intent, ''), '_', ' ')), 'B') ||
+    setweight(to_tsvector('english', coalesce({row}problem_description, '')), 'C')
+""".strip()
+
+MIGRATIONS = [
+    Migration(1, 'base tables', [
+        """
+        CREATE TABLE IF NOT EXISTS appointments (
+            id SERIAL PRIMARY KEY,
+            intent TEXT,
+            name TEXT,
+            problem_description TEXT,
+            location TEXT,
+            contact TEXT,
+            time_slot TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS technicians (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            expertise TEXT NOT NULL,
+            location TEXT NOT NULL,
+            contact TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+        """,
+    ], False),
+    # Trigram index so that ``intent LIKE '%expertise%'`` becomes a bitmap
+    # index scan instead of a sequential scan, with unchanged matching rules
+    Migration(2, 'trigram index on appointments.intent', [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS appointments_intent_trgm_idx "
+        "ON appointments USING gin (intent gin_trgm_ops)",
+    ], True),
+    # Serves the dashboard's "today" range scan, the analytics window and the
+    # keyset-ordered history pages, all of which filter on location first
+    Migration(3, 'composite index on appointments (location, created_at)', [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS appointments_location_created_at_idx "
+        "ON appointments (location, created_at DESC, id DESC)",
+    ], True),
+    # Pre-aggregated counts for analytics, kept current by statement-level
+    # triggers; see rollup.py for the read path and the rebuild command
+    Migration(4, 'appointment rollup tables and triggers', [
+        """
+        CREATE TABLE IF NOT EXISTS appointment_daily_rollup (
+            day DATE NOT NULL,
+            location TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (location, day, intent)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS appointment_intent_totals (
+            location TEXT NOT NULL,
+            intent TEXT NOT NULL,
+            count BIGINT NOT NULL,
+            PRIMARY KEY (location, intent)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS appointment_rollup_config (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            storage_tz TEXT NOT NULL,
+            business_tz TEXT NOT NULL,
+            rebuilt_at TIMESTAMP
+        )
+        """,
+        """
+        INSERT INTO appointment_rollup_config (storage_tz, business_tz)
+        VALUES ('UTC', 'UTC') ON CONFLICT DO NOTHING
+        """,
+        """
+        CREATE OR REPLACE FUNCTION appointment_rollup_apply() RETURNS trigger AS $$
+        DECLARE
+            cfg appointment_rollup_config%ROWTYPE;
+        BEGIN
+            SELECT * INTO cfg FROM appointment_rollup_config;
+
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                WITH changed AS (
+                    SELECT DATE(created_at AT TIME ZONE cfg.storage_tz AT TIME ZONE cfg.business_tz) AS day,
+                           location, intent, COUNT(*) AS count
+                    FROM old_rows
+                    WHERE location IS NOT NULL AND intent IS NOT NULL AND created_at IS NOT NULL
+                    GROUP BY 1, 2, 3
+                ), daily AS (
+                    UPDATE appointment_daily_rollup r SET count = r.count - c.count
+                    FROM changed c
+                    WHERE r.location = c.location AND r.day = c.day AND r.intent = c.intent
+                )
+                UPDATE appointment_intent_totals t SET count = t.count - c.count
+                FROM (SELECT location, intent, SUM(count) AS count FROM changed GROUP BY 1, 2) c
+                WHERE t.location = c.location AND t.intent = c.intent;
+            END IF;
+
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                WITH changed AS (
+                    SELECT DATE(created_at AT TIME ZONE cfg.storage_tz AT TIME ZONE cfg.business_tz) AS day,
+                           location, intent, COUNT(*) AS count
+                    FROM new_rows
+                    WHERE location IS NOT NULL AND intent IS NOT NULL AND created_at IS NOT NULL
+                    GROUP BY 1, 2, 3
+                ), daily AS (
+                    INSERT INTO appointment_daily_rollup AS r (day, location, intent, count)
+                    SELECT day, location, intent, count FROM changed
+                    ON CONFLICT (location, day, intent) DO UPDATE SET count = r.count + EXCLUDED.count
+                )
+                INSERT INTO appointment_intent_totals AS t (location, intent, count)
+                SELECT location, intent, SUM(count) FROM changed GROUP BY 1, 2
+                ON CONFLICT (location, intent) DO UPDATE SET count = t.count + EXCLUDED.count;
+            END IF;
+
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS appointments_rollup_insert ON appointments",
+        "DROP TRIGGER IF EXISTS appointments_rollup_update ON appointments",
+        "DROP TRIGGER IF EXISTS appointments_rollup_delete ON appointments",
+        """
+        CREATE TRIGGER appointments_rollup_insert AFTER INSERT ON appointments
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION appointment_rollup_apply()
+        """,
+        """
+        CREATE TRIGGER appointments_rollup_update AFTER UPDATE ON appointments
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION appointment_rollup_apply()
+        """,
+        """
+        CREATE TRIGGER appointments_rollup_delete AFTER DELETE ON appointments
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION appointment_rollup_apply()
+        """,
+    ] + ROLLUP_REBUILD_STATEMENTS, False),
+    # One NOTIFY per INSERT statement carrying the id range it wrote; the
+    # live dashboard listener (live.py) loads matching rows from that range
+    Migration(5, 'notify live dashboard listeners on appointment insert', [
+        """
+        CREATE OR REPLACE FUNCTION appointment_notify_insert() RETURNS trigger AS $$
+        DECLARE
+            first_id INTEGER;
+            last_id INTEGER;
+        BEGIN
+            SELECT MIN(id), MAX(id) INTO first_id, last_id FROM new_rows;
+            IF first_id IS NOT NULL THEN
+                PERFORM pg_notify('appointments_inserted',
+                                  json_build_object('first_id', first_id, 'last_id', last_id)::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS appointments_notify_insert ON appointments",
+        """
+        CREATE TRIGGER appointments_notify_insert AFTER INSERT ON appointments
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION appointment_notify_insert()
+        """,
+    ], False),
+    # Natural key of rows loaded by the bulk ingestion pipeline (ingest.py);
+    # re-running an import skips rows whose key is already present.  Rows
+    # written by other means leave it NULL, which the unique index allows.
+    Migration(6, 'appointments.source_key for idempotent ingestion', [
+        "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS source_key TEXT",
+    ], False),
+    Migration(7, 'unique index on appointments.source_key', [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS appointments_source_key_idx "
+        "ON appointments (source_key)",
+    ], True),
+    # Search document kept current by a row trigger, so new rows are
+    # searchable as soon as they are inserted
+    Migration(8, 'appointments.search_vector and its trigger', [
+        "ALTER TABLE appointments ADD COLUMN IF NOT EXISTS search_vector TSVECTOR",
+        f"""
+        CREATE OR REPLACE FUNCTION appointment_search_vector() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR_SQL.format(row='NEW.')};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS appointments_search_vector ON appointments",
+        """
+        CREATE TRIGGER appointments_search_vector
+        BEFORE INSERT OR UPDATE OF name, intent, problem_description ON appointments
+        FOR EACH ROW EXECUTE FUNCTION appointment_search_vector()
+        """,
+    ], False),
+    # Backfill existing rows in committed batches of 10000 ids so no long
+    # lock is held, then index (location, search_vector) together; btree_gin
+    # lets one GIN index serve both the location filter and the text match
+    Migration(9, 'backfill and index appointments.search_vector', [
+        f"""
+        DO $$
+        DECLARE
+            batch_start INTEGER := 0;
+            max_id INTEGER;
+        BEGIN
+            SELECT COALESCE(MAX(id), 0) INTO max_id FROM appointments;
+            WHILE batch_start < max_id LOOP
+                UPDATE appointments SET search_vector = {SEARCH_VECTOR_SQL.format(row='')}
+                WHERE id > batch_start AND id <= batch_start + 10000 AND search_vector IS NULL;
+                batch_start := batch_start + 10000;
+                COMMIT;
+            END LOOP;
+        END
+        $$
+        """,
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS appointments_search_idx "
+        "ON appointments USING gin (location, search_vector)",
+    ], True),
+    # Analytics results, CSV report bodies and chart PNGs per (location,
+    # expertise, window), written by the nightly precompute batch
+    # (precompute.py).  ``watermark`` is the newest appointment id the batch
+    # saw; an artifact is stale once a matching appointment has a larger id.
+    Migration(10, 'precomputed analytics artifacts', [
+        """
+        CREATE TABLE IF NOT EXISTS analytics_artifacts (
+            location TEXT NOT NULL,
+            expertise TEXT NOT NULL,
+            window_range TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            first_day DATE NOT NULL,
+            last_day DATE NOT NULL,
+            watermark INTEGER NOT NULL,
+            etag TEXT,
+            content BYTEA NOT NULL,
+            generated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (location, expertise, window_range, granularity, kind)
+        )
+        """,
+    ], False),
+    # One NOTIFY per changed or deleted technician row carrying its id; each
+    # worker drops that technician from its session cache (sessions.py)
+    Migration(11, 'notify session caches on technician change', [
+        """
+        CREATE OR REPLACE FUNCTION technician_notify_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('technicians_changed', OLD.id::text);
+            IF TG_OP = 'UPDATE' AND NEW.id <> OLD.id THEN
+                PERFORM pg_notify('technicians_changed', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS technicians_notify_change ON technicians",
+        """
+        CREATE TRIGGER technicians_notify_change AFTER UPDATE OR DELETE ON technicians
+        FOR EACH ROW EXECUTE FUNCTION technician_notify_change()
+        """,
+    ], False),
+    # Login looks technicians up by email.  Duplicate emails make the build
+    # fail; resolve them before migrating.
+    Migration(12, 'unique index on technicians.email', [
+        "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS technicians_email_idx ON technicians (email)",
+    ], True),
+    # TRUNCATE fires no row or transition-table triggers, so the rollup
+    # (migration 4) would keep the old counts and stored artifacts would
+    # carry watermarks ahead of re-numbered ids; empty them along with it
+    Migration(13, 'clear rollup and artifacts when appointments are truncated', [
+        """
+        CREATE OR REPLACE FUNCTION appointment_rollup_truncate() RETURNS trigger AS $$
+        BEGIN
+            TRUNCATE appointment_daily_rollup, appointment_intent_totals, analytics_artifacts;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS appointments_rollup_truncate ON appointments",
+        """
+        CREATE TRIGGER appointments_rollup_truncate AFTER TRUNCATE ON appointments
+        FOR EACH STATEMENT EXECUTE FUNCTION appointment_rollup_truncate()
+        """,
+    ], False),
+]
+
+
+# Compact row types and the column list each query selects.  Queries return
+# plain tuples which are wrapped in these namedtuples, so rows cost one small
+# tuple each instead of a DictRow, and templates keep using attribute access.
+Appointment = namedtuple('Appointment', [
+    'id', 'created_at', 'time_slot', 'name', 'intent', 'problem_description', 'location', 'contact'])
+Technician = namedtuple('Technician', ['id', 'name', 'expertise', 'location', 'contact', 'email'])
+
+APPOINTMENT_COLUMNS = ', '.join(Appointment._fields)
+TECHNICIAN_COLUMNS = ', '.join(Technician._fields)
+
+# Columns of the history CSV export, in file order; the date is cast in SQL
+# so rows can be handed to csv.writer as they come off the cursor
+HISTORY_EXPORT_HEADER = ['Date', 'Time Slot', 'Client Name', 'Issue Type', 'Problem Description', 'Location', 'Contact']
+HISTORY_EXPORT_COLUMNS = 'created_at::date, time_slot, name, intent, problem_description, location, contact'
+
+
+def appointment_to_json(appointment):
+    """JSON-safe dict of an Appointment, as used by the history API and live dashboard"""
+    return {
+        'id': appointment.id,
+        'created_at': appointment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'time_slot': appointment.time_slot,
+        'name': appointment.name,
+        'intent': appointment.intent,
+        'problem_description': appointment.problem_description,
+        'location': appointment.location,
+        'contact': appointment.contact
+    }
+
+
+def authenticate_technician(conn, email, password):
+    """Return the Technician matching the credentials, or None"""
+    cur = conn.cursor()
+    cur.execute(f"SELECT {TECHNICIAN_COLUMNS} FROM technicians WHERE email = %s AND password = %s",
+                (email, password))
+    row = cur.fetchone()
+    cur.close()
+    return Technician._make(row) if row else None
+
+
+def get_technician(conn, technician_id):
+    cur = conn.cursor()
+    cur.execute(f"SELECT {TECHNICIAN_COLUMNS} FROM technicians WHERE id = %s", (technician_id,))
+    row = cur.fetchone()
+    cur.close()
+    return Technician._make(row) if row else None
+
+
+def todays_appointments(conn, location, expertise, day_start, day_end):
+    """Appointments for the dashboard created in [day_start, day_end), newest first"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {APPOINTMENT_COLUMNS} FROM appointments 
+        WHERE location = %s 
+        AND created_at >= %s 
+        AND created_at < %s
+        AND intent LIKE %s 
+        ORDER BY created_at DESC
+    """, (location, day_start, day_end, f"%{expertise}%"))
+    rows = list(map(Appointment._make, cur.fetchall()))
+    cur.close()
+    return rows
+
+
+def history_page(conn, location, expertise, after=None, limit=50):
+    """Return up to ``limit + 1`` Appointments older than the (created_at, id) position ``after``.
+
+    Newest first; the extra row tells pagination.split_page() whether
+    another page follows.
+    """
+    cur = conn.cursor()
+    if after is None:
+        cur.execute(f"""
+            SELECT {APPOINTMENT_COLUMNS} FROM appointments 
+            WHERE location = %s 
+            AND intent LIKE %s 
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (location, f"%{expertise}%", limit + 1))
+    else:
+        cur.execute(f"""
+            SELECT {APPOINTMENT_COLUMNS} FROM appointments 
+            WHERE location = %s 
+            AND intent LIKE %s 
+            AND (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (location, f"%{expertise}%", after[0], after[1], limit + 1))
+    rows = list(map(Appointment._make, cur.fetchall()))
+    cur.close()
+    return rows
+
+
+def history_export_cursor(conn, location, expertise, name='history_export'):
+    """Open a server-side cursor over the full history as HISTORY_EXPORT_COLUMNS tuples.
+
+    ``conn`` must not be in autocommit mode; the caller fetches in batches
+    and closes the cursor.
+    """
+    cur = conn.cursor(name=name)
+    cur.execute(f"""
+        SELECT {HISTORY_EXPORT_COLUMNS} FROM appointments 
+        WHERE location = %s 
+        AND intent LIKE %s 
+        ORDER BY created_at DESC
+    """, (location, f"%{expertise}%"))
+    return cur
+
+
+def appointments_in_id_range(conn, first_id, last_id, locations, start, end):
+    """Appointments with ids in [first_id, last_id] at any of ``locations``, created in [start, end)"""
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT {APPOINTMENT_COLUMNS} FROM appointments
+        WHERE id BETWEEN %s AND %s
+        AND location = ANY(%s)
+        AND created_at >= %s AND created_at < %s
+        ORDER BY created_at
+    """, (first_id, last_id, locations, start, end))
+    rows = list(map(Appointment._make, cur.fetchall()))
+    cur.close()
+    return rows
+
+
+def search_appointments(conn, location, expertise, text, limit=50, offset=0):
+    """Rank a technician's appointments against a web-style search string.
+
+    Returns up to ``limit + 1`` (Appointment, rank) pairs, best match first
+    and newest first among equal ranks.  Words are matched both stemmed and
+    as typed, so "leaking" finds "leak" in descriptions and exact client names.
+    """
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH q AS (
+            SELECT websearch_to_tsquery('english', %(text)s) || websearch_to_tsquery('simple', %(text)s) AS query
+        )
+        SELECT {', '.join('a.' + column for column in Appointment._fields)},
+               ts_rank_cd(a.search_vector, q.query) AS rank
+        FROM appointments a, q
+        WHERE a.location = %(location)s
+        AND a.intent LIKE %(intent)s
+        AND a.search_vector @@ q.query
+        ORDER BY rank DESC, a.created_at DESC, a.id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    """, {'text': text, 'location': location, 'intent': f"%{expertise}%", 'limit': limit + 1, 'offset': offset})
+    rows = [(Appointment._make(row[:-1]), row[-1]) for row in cur.fetchall()]
+    cur.close()
+    return rows
+
+
+def appointments_fingerprint(conn, location, expertise):
+    """(count, newest created_at, newest id) of all appointments for a (location, expertise).
+
+    The count comes from the trigger-maintained intent totals and the newest
+    row from one probe of the (location, created_at, id) index, so this stays
+    cheap however long the history is.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT t.count, n.created_at, n.id
+        FROM (
+            SELECT COALESCE(SUM(count), 0) AS count FROM appointment_intent_totals
+            WHERE location = %s AND intent LIKE %s
+        ) t
+        LEFT JOIN LATERAL (
+            SELECT created_at, id FROM appointments
+            WHERE location = %s AND intent LIKE %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ) n ON TRUE
+    """, (location, f"%{expertise}%", location, f"%{expertise}%"))
+    row = cur.fetchone()
+    cur.close()
+    return tuple(row)
+
+
+def appointments_range_fingerprint(conn, location, expertise, start, end):
+    """(count, newest created_at, max id) of a technician's appointments created in [start, end)"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*), MAX(created_at), MAX(id) FROM appointments
+        WHERE location = %s
+        AND created_at >= %s
+        AND created_at < %s
+        AND intent LIKE %s
+    """, (location, start, end, f"%{expertise}%"))
+    row = cur.fetchone()
+    cur.close()
+    return tuple(row)
+
+
+def technician_pairs(conn):
+    """Distinct (location, expertise) pairs of all technicians"""
+    cur = conn.cursor()
+    cur.execute("SELECT DISTINCT location, expertise FROM technicians ORDER BY location, expertise")
+    rows = [tuple(row) for row in cur.fetchall()]
+    cur.close()
+    return rows
+
+
+def appointment_day_counts(conn, locations, storage_tz, business_tz):
+    """(watermark, rows) for the precompute batch: one scan of appointments at ``locations``.
+
+    Rows are (location, intent, business-timezone day, count); the day is
+    NULL for rows without created_at.  The watermark is the newest id, read
+    in the same snapshot.  ``conn`` must be in autocommit mode.
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+    try:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM appointments")
+        watermark = cur.fetchone()[0]
+        cur.execute("""
+            SELECT location, intent, DATE(created_at AT TIME ZONE %s AT TIME ZONE %s) AS day, COUNT(*)
+            FROM appointments
+            WHERE location = ANY(%s) AND intent IS NOT NULL
+            GROUP BY 1, 2, 3
+        """, (storage_tz, business_tz, list(locations)))
+        rows = cur.fetchall()
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    cur.close()
+    return watermark, rows
+
+
+def analytics_artifact(conn, location, expertise, window, kind):
+    """(content, etag) of a precomputed artifact for ``window``, or None if missing or stale.
+
+    Stale means stored for other window dates, or a matching appointment was
+    added after the batch ran; that probe walks the primary key from the
+    stored watermark, so it only touches rows inserted since.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT a.content, a.etag FROM analytics_artifacts a
+        WHERE a.location = %(location)s
+        AND a.expertise = %(expertise)s
+        AND a.window_range = %(range)s
+        AND a.granularity = %(granularity)s
+        AND a.kind = %(kind)s
+        AND a.first_day = %(first_day)s
+        AND a.last_day = %(last_day)s
+        AND NOT EXISTS (
+            SELECT 1 FROM appointments n
+            WHERE n.id > a.watermark
+            AND n.location = a.location
+            AND n.intent LIKE %(intent)s
+        )
+    """, {'location': location, 'expertise': expertise, 'range': window.range,
+          'granularity': window.granularity, 'kind': kind, 'first_day': window.first_day,
+          'last_day': window.last_day, 'intent': f"%{expertise}%"})
+    row = cur.fetchone()
+    cur.close()
+    return (bytes(row[0]), row[1]) if row else None
+
+
+def replace_analytics_artifacts(conn, artifacts, watermark):
+    """Store the precompute batch's output and drop every artifact it did not produce.
+
+    ``artifacts`` are (location, expertise, window, kind, etag, content)
+    tuples.  Runs in one transaction, so readers switch over atomically;
+    ``conn`` must be in autocommit mode.
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    try:
+        cur.executemany("""
+            INSERT INTO analytics_artifacts
+                (location, expertise, window_range, granularity, kind, first_day, last_day,
+                 watermark, etag, content, generated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (location, expertise, window_range, granularity, kind) DO UPDATE SET
+                first_day = EXCLUDED.first_day, last_day = EXCLUDED.last_day,
+                watermark = EXCLUDED.watermark, etag = EXCLUDED.etag,
+                content = EXCLUDED.content, generated_at = EXCLUDED.generated_at
+        """, [(location, expertise, window.range, window.granularity, kind, window.first_day,
+               window.last_day, watermark, etag, content)
+              for location, expertise, window, kind, etag, content in artifacts])
+        # NOW() is the transaction start, so this keeps exactly the rows written above
+        cur.execute("DELETE FROM analytics_artifacts WHERE generated_at < NOW()")
+        removed = cur.rowcount
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    cur.close()
+    return removed
+
+
+def _ensure_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def current_version(conn):
+    cur = conn.cursor()
+    _ensure_version_table(cur)
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    version = cur.fetchone()[0]
+    cur.close()
+    return version
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to ``target`` (default: latest) and return the new version.
+
+    ``conn`` must be in autocommit mode; transactional migrations are wrapped
+    in their own BEGIN/COMMIT.
+    """
+    version = current_version(conn)
+    cur = conn.cursor()
+    for migration in MIGRATIONS:
+        if migration.version <= version or (target is not None and migration.version > target):
+            continue
+        logger.info("Applying migration %s: %s", migration.version, migration.description)
+        if not migration.concurrent:
+            cur.execute("BEGIN")
+        try:
+            for statement in migration.statements:
+                cur.execute(statement)
+            cur.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                (migration.version, migration.description))
+        except Exception:
+            if not migration.concurrent:
+                cur.execute("ROLLBACK")
+            raise
+        if not migration.concurrent:
+            cur.execute("COMMIT")
+        version = migration.version
+    cur.close()
+    return version
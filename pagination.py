@@ -0,0 +1,45 @@
+import base64
+import os
+from datetime import datetime
+
+# Rows per history page, and the most a client may request with ?limit=
+DEFAULT_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("HISTORY_MAX_PAGE_SIZE", 200))
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(created_at, row_id):
+    """Encode the (created_at, id) keyset position of a row as an opaque token"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor() back to (created_at, id)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"invalid cursor: {token!r}") from e
+
+
+def page_size(value):
+    """Clamp a requested page size to [1, MAX_PAGE_SIZE], defaulting when missing"""
+    try:
+        size = int(value) if value else DEFAULT_PAGE_SIZE
+    except ValueError:
+        size = DEFAULT_PAGE_SIZE
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def split_page(rows, limit, key=lambda row: (row.created_at, row.id)):
+    """Split ``limit + 1`` fetched rows into the page and the cursor for the next one"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
@@ -0,0 +1,146 @@
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import business_time
+import charts
+import models
+from analytics import AnalyticsResult, report_csv, resolve_window
+
+logger = logging.getLogger(__name__)
+
+# Windows rendered by the nightly batch: the analytics page and CSV default
+# and the chart default; requests for other windows are computed on demand
+RANGES = [value.strip() for value in os.environ.get("PRECOMPUTE_RANGES", "7d,14d").split(',') if value.strip()]
+
+# Render processes; 0 renders in this process
+WORKERS = int(os.environ.get("PRECOMPUTE_WORKERS", os.cpu_count() or 1))
+
+
+def _like_pattern(expertise):
+    """Regex equivalent of the routes' ``intent LIKE '%expertise%'`` filter"""
+    return re.escape(expertise).replace('%', '.*').replace('_', '.')
+
+
+def compute_all(rows, pairs, windows):
+    """AnalyticsResult for every (location, expertise) pair and window, from one set of day counts.
+
+    ``rows`` are appointment_day_counts() rows.  Matching, totals, per-intent
+    counts and bucketing are vectorized pandas operations over all pairs at
+    once; the result is keyed by (location, expertise, window) and equals
+    what compute_analytics() returns for each.
+    """
+    import pandas as pd
+
+    counts = pd.DataFrame(rows, columns=['location', 'intent', 'day', 'count'])
+    counts['day'] = pd.to_datetime(counts['day'])
+    # One row per (appointment day count, technician pair at that location)
+    matched = counts.merge(pd.DataFrame(pairs, columns=['location', 'expertise']), on='location')
+    keep = pd.Series(False, index=matched.index)
+    for expertise, index in matched.groupby('expertise').groups.items():
+        keep[index] = matched.loc[index, 'intent'].str.contains(_like_pattern(expertise), regex=True)
+    matched = matched[keep]
+
+    totals = matched.groupby(['location', 'expertise'])['count'].sum()
+    issues = {}
+    for (location, expertise, intent), count in matched.groupby(['location', 'expertise', 'intent'])['count'].sum().items():
+        issues.setdefault((location, expertise), []).append((intent, int(count)))
+
+    results = {}
+    for window in windows:
+        first, last = pd.Timestamp(window.first_day), pd.Timestamp(window.last_day)
+        in_window = matched[(matched['day'] >= first) & (matched['day'] <= last)]
+        days = in_window['day']
+        if window.granularity == 'week':
+            buckets = days - pd.to_timedelta(days.dt.weekday, unit='D')
+        elif window.granularity == 'month':
+            buckets = days.dt.to_period('M').dt.to_timestamp()
+        else:
+            buckets = days
+        bucket_counts = {}
+        for (location, expertise, bucket), count in in_window.assign(bucket=buckets).groupby(
+                ['location', 'expertise', 'bucket'])['count'].sum().items():
+            bucket_counts[(location, expertise, bucket.date())] = int(count)
+
+        for location, expertise in pairs:
+            pair_issues = sorted(issues.get((location, expertise), []), key=lambda item: (-item[1], item[0]))
+            results[(location, expertise, window)] = AnalyticsResult(
+                window=window,
+                total_count=int(totals.get((location, expertise), 0)),
+                series=[(bucket, bucket_counts.get((location, expertise, bucket), 0)) for bucket in window.buckets],
+                issues=pair_issues,
+            )
+    return results
+
+
+def render_artifacts(location, expertise, result):
+    """(kind, etag, content) for the stored result, the CSV report body and every chart.
+
+    Runs inside a render process unless WORKERS is 0.
+    """
+    artifacts = [
+        ('result', None, result.to_json().encode('utf-8')),
+        ('csv', None, report_csv(result).encode('utf-8')),
+    ]
+    for chart_type in charts.CHART_TYPES:
+        artifacts.append((chart_type, charts.fingerprint(chart_type, location, expertise, result),
+                          charts.render_chart(chart_type, location, expertise, result)))
+    return artifacts
+
+
+def _init_render_process():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def run(conn, ranges=None, workers=WORKERS):
+    """Precompute and store analytics artifacts for every technician pair; return a summary dict.
+
+    ``conn`` must be in autocommit mode.
+    """
+    started = time.perf_counter()
+    windows = list(dict.fromkeys(resolve_window(value) for value in (ranges or RANGES)))
+    pairs = models.technician_pairs(conn)
+    watermark, rows = models.appointment_day_counts(
+        conn, sorted({location for location, _ in pairs}),
+        business_time.STORAGE_TIMEZONE.key, business_time.BUSINESS_TIMEZONE.key)
+    scanned = time.perf_counter()
+
+    results = compute_all(rows, pairs, windows)
+    computed = time.perf_counter()
+
+    jobs = list(results.items())
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context(charts.START_METHOD),
+                                 initializer=_init_render_process) as executor:
+            rendered = list(executor.map(render_artifacts, *zip(*[
+                (location, expertise, result) for (location, expertise, _), result in jobs])))
+    else:
+        rendered = [render_artifacts(location, expertise, result) for (location, expertise, _), result in jobs]
+    render_finished = time.perf_counter()
+
+    artifacts = [
+        (location, expertise, window, kind, etag, content)
+        for ((location, expertise, window), _), pair_artifacts in zip(jobs, rendered)
+        for kind, etag, content in pair_artifacts
+    ]
+    removed = models.replace_analytics_artifacts(conn, artifacts, watermark)
+    finished = time.perf_counter()
+
+    summary = {
+        'pairs': len(pairs),
+        'windows': [window.range for window in windows],
+        'artifacts': len(artifacts),
+        'bytes': sum(len(artifact[5]) for artifact in artifacts),
+        'removed': removed,
+        'watermark': watermark,
+        'scan_seconds': round(scanned - started, 3),
+        'compute_seconds': round(computed - scanned, 3),
+        'render_seconds': round(render_finished - computed, 3),
+        'store_seconds': round(finished - render_finished, 3),
+    }
+    logger.info("Precomputed analytics: %s", summary)
+    return summary
@@ -0,0 +1,38 @@
+import logging
+import business_time
+from models import ROLLUP_REBUILD_STATEMENTS
+
+logger = logging.getLogger(__name__)
+
+
+def rebuild(conn):
+    """Recompute the rollup tables from appointments using the configured timezones.
+
+    ``conn`` must be in autocommit mode; the rebuild runs in one transaction.
+    """
+    cur = conn.cursor()
+    cur.execute("BEGIN")
+    try:
+        cur.execute(
+            "UPDATE appointment_rollup_config SET storage_tz = %s, business_tz = %s",
+            (business_time.STORAGE_TIMEZONE.key, business_time.BUSINESS_TIMEZONE.key))
+        for statement in ROLLUP_REBUILD_STATEMENTS:
+            cur.execute(statement)
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM appointment_daily_rollup")
+        rows, appointments = cur.fetchone()
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    cur.execute("COMMIT")
+    cur.close()
+    logger.info("Rebuilt appointment rollup: %s daily rows covering %s appointments", rows, appointments)
+    return rows, appointments
+
+
+def timezones_match(conn):
+    """Whether the rollup was built with the BUSINESS_TIMEZONE / DB_TIMEZONE in effect"""
+    cur = conn.cursor()
+    cur.execute("SELECT storage_tz, business_tz FROM appointment_rollup_config")
+    row = cur.fetchone()
+    cur.close()
+    return row == (business_time.STORAGE_TIMEZONE.key, business_time.BUSINESS_TIMEZONE.key)
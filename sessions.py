@@ -0,0 +1,295 @@
+import copy
+import logging
+import os
+import re
+import secrets
+import select
+import threading
+import time
+from flask import g, session
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature
+from werkzeug.datastructures import CallbackDict
+import cache
+import db
+import models
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'technicians_changed'
+
+# Where sessions live: unset keeps them in each worker process, which only
+# works with a single worker; redis://... shares them (requires the redis
+# extra), local:// is the in-process stand-in for the shared store and is
+# not shared either.  More than one worker without a shared store falls back
+# to signed-cookie sessions (check_store).
+STORE_URL = os.environ.get("SESSION_STORE_URL")
+
+# Seconds a session survives without being used, and sessions kept in-process
+TTL = float(os.environ.get("SESSION_TTL", 12 * 3600))
+MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 10000))
+
+# Technician records of signed-in technicians; entries are dropped on
+# technician row changes (migration 11), the TTL only bounds a missed one
+TECHNICIAN_CACHE_URL = os.environ.get("TECHNICIAN_CACHE_URL", STORE_URL)
+TECHNICIAN_CACHE_TTL = float(os.environ.get("TECHNICIAN_CACHE_TTL", 3600))
+
+# Seconds the listener waits on its connection between liveness checks
+LISTEN_TIMEOUT = 30
+
+_SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+def _new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session data held server-side once signed in; the cookie carries only its random id.
+
+    ``new`` is true while nothing is stored server-side for the session.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False, saved_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid or _new_sid()
+        self.new = new
+        self.saved_at = saved_at
+        self.modified = False
+        self._old_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, e.g. on login, so a planted id is never signed in"""
+        if self._old_sid is None and not self.new:
+            self._old_sid = self.sid
+        self.sid = _new_sid()
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface over a cache backend (cache.make_backend).
+
+    Only signed-in sessions are stored server-side, so anonymous clients
+    cannot fill the store and evict them; anonymous data (flash messages
+    before login) stays in a signed cookie as with Flask's default sessions.
+    Stored data is written only when it changes, or when more than half its
+    TTL has passed so that sessions in use do not expire.
+    """
+
+    def __init__(self, backend, ttl=TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._signed = SecureCookieSessionInterface()
+
+    def open_session(self, app, request):
+        value = request.cookies.get(self.get_cookie_name(app))
+        if value and _SESSION_ID.match(value):
+            stored = self.backend.get(('session', value))
+            if stored is not None:
+                saved_at, data = stored
+                # The in-process backend hands out the stored object itself
+                return ServerSession(copy.deepcopy(data), value, saved_at=saved_at)
+        elif value:
+            serializer = self._signed.get_signing_serializer(app)
+            if serializer is not None:
+                try:
+                    return ServerSession(serializer.loads(value, max_age=int(self.ttl)), new=True)
+                except BadSignature:
+                    pass
+        return ServerSession(new=True)
+
+    def _set_cookie(self, app, session, response, value):
+        response.set_cookie(
+            self.get_cookie_name(app), value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+        response.vary.add('Cookie')
+
+    def save_session(self, app, session, response):
+        if session._old_sid is not None:
+            self.backend.delete(('session', session._old_sid))
+        signed_in = 'technician_id' in session
+        if not session.new and not signed_in:
+            # Signed out (or emptied): drop the stored copy
+            self.backend.delete(('session', session.sid))
+
+        if not session:
+            if session.modified:
+                response.delete_cookie(self.get_cookie_name(app), domain=self.get_cookie_domain(app),
+                                       path=self.get_cookie_path(app))
+            return
+
+        if not signed_in:
+            serializer = self._signed.get_signing_serializer(app)
+            if session.modified and serializer is not None:
+                self._set_cookie(app, session, response, serializer.dumps(dict(session)))
+            return
+
+        now = time.time()
+        stale = session.saved_at is None or now - session.saved_at > self.ttl / 2
+        if not (session.modified or stale):
+            return
+        self.backend.set(('session', session.sid), (now, dict(session)), self.ttl)
+        self._set_cookie(app, session, response, session.sid)
+
+
+technician_cache = cache.ResultCache(
+    cache.make_backend(TECHNICIAN_CACHE_URL, max_entries=MAX_ENTRIES, prefix='portal:technician:'),
+    ttl=TECHNICIAN_CACHE_TTL,
+)
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when a technician record is not cached and cannot be loaded"""
+
+
+def sign_in(technician):
+    """Start a session for ``technician`` (a models.Technician) and cache its record"""
+    session.clear()
+    if isinstance(session, ServerSession):
+        session.regenerate()
+    session['technician_id'] = technician.id
+    get_listener().start()
+    technician_cache.set(technician.id, technician)
+
+
+def current_technician():
+    """The signed-in technician's record, from the cache when possible.
+
+    Returns None when nobody is signed in or the technician no longer
+    exists; raises DatabaseUnavailable on a cache miss the database cannot
+    serve.
+    """
+    if 'technician' in g:
+        return g.technician
+    technician_id = session.get('technician_id')
+    technician = None
+    if technician_id is not None:
+        technician = technician_cache.get(technician_id)
+        if technician is None:
+            # The primary: just after a change a replica may still return the old row
+            conn = db.get_db_connection()
+            if not conn:
+                raise DatabaseUnavailable('Could not load technician record')
+            try:
+                technician = models.get_technician(conn, technician_id)
+            finally:
+                conn.close()
+            if technician is not None:
+                technician_cache.set(technician_id, technician)
+        get_listener().start()
+    g.technician = technician
+    return technician
+
+
+class TechnicianListener:
+    """Drops technicians from technician_cache as the database reports changes.
+
+    One background thread per worker process LISTENs on CHANNEL.  Changes
+    made while it was disconnected are not reported, so the whole cache is
+    cleared each time it (re)connects.
+    """
+
+    def __init__(self, connect_fn=db.connect):
+        self._connect = connect_fn
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='technician-listener', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = self._connect()
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {CHANNEL}")
+                technician_cache.invalidate()
+                backoff = 1
+                logger.info("Listening for %s notifications", CHANNEL)
+                while True:
+                    if select.select([conn], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            technician_cache.invalidate(int(notify.payload))
+                        except ValueError:
+                            logger.warning("Ignoring malformed %s payload: %r", CHANNEL, notify.payload)
+            except Exception as e:
+                logger.warning("Technician listener failed, reconnecting in %ss: %s", backoff, e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Return this process's listener, creating it lazily (and again after a fork)"""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    with _listener_lock:
+        if _listener is None or _listener_pid != pid:
+            _listener = TechnicianListener()
+            _listener_pid = pid
+        return _listener
+
+
+def _template_context():
+    try:
+        return {'current_technician': current_technician()}
+    except DatabaseUnavailable:
+        return {'current_technician': None}
+
+
+def make_store():
+    """The session store configured by SESSION_STORE_URL"""
+    return cache.make_backend(STORE_URL, max_entries=MAX_ENTRIES, prefix='portal:session:')
+
+
+def is_shared(backend):
+    """True when every worker process sees the same data through ``backend``"""
+    return isinstance(backend, cache.SharedBackend) and not isinstance(backend.client, cache.LocalStore)
+
+
+def check_store(app, workers):
+    """Fall back to signed-cookie sessions when ``workers`` processes would each keep their own.
+
+    Requests reach workers at random, so per-process sessions would sign
+    technicians out on every other request.  A signed cookie is read by any
+    worker, but logout cannot revoke a copy of it before it expires.
+    """
+    interface = app.session_interface
+    if workers > 1 and isinstance(interface, ServerSessionInterface) and not is_shared(interface.backend):
+        logger.warning("%d workers but no shared session store; keeping sessions in signed cookies. "
+                       "Set SESSION_STORE_URL to a redis:// URL (install the redis extra) "
+                       "to keep them server-side", workers)
+        app.session_interface = SecureCookieSessionInterface()
+
+
+def init_app(app):
+    app.session_interface = ServerSessionInterface(make_store())
+    check_store(app, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    app.context_processor(_template_context)
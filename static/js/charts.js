@@ -9,7 +9,9 @@ document.addEventListener('DOMContentLoaded', function() {
   if (document.getElementById('appointmentsPerDayChart')) {
     createAppointmentsPerDayChart(
       analyticsData.dates, 
-      analyticsData.daily_counts
+      analyticsData.daily_counts,
+      analyticsData.granularity || 'day',
+      analyticsData.window_label || 'last 7 days'
     );
   }
   
@@ -22,8 +24,8 @@ document.addEventListener('DOMContentLoaded', function() {
   }
 });
 
-// Function to create the appointments per day chart
-function createAppointmentsPerDayChart(dates, counts) {
+// Function to create the appointments per day/week/month chart
+function createAppointmentsPerDayChart(dates, counts, granularity, windowLabel) {
   const ctx = document.getElementById('appointmentsPerDayChart').getContext('2d');
   
   new Chart(ctx, {
@@ -52,7 +54,8 @@ function createAppointmentsPerDayChart(dates, counts) {
       plugins: {
         title: {
           display: true,
-          text: 'Appointments Per Day (Last 7 Days)'
+          text: 'Appointments Per ' + granularity.charAt(0).toUpperCase() + granularity.slice(1) +
+                ' (' + windowLabel.charAt(0).toUpperCase() + windowLabel.slice(1) + ')'
         },
         legend: {
           display: false
@@ -0,0 +1,29 @@
+import types
+import psycopg2
+import pytest
+import db
+import sessions
+from app import app
+from fakes import TECHNICIAN, FakeConnection
+
+
+@pytest.fixture
+def client(monkeypatch):
+    connections = []
+
+    def fake_connect(*args, **kwargs):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', fake_connect)
+    monkeypatch.setattr(db, '_pools', {})
+    monkeypatch.setattr(db, 'replicas', [])
+    monkeypatch.setattr(sessions, 'get_listener', lambda: types.SimpleNamespace(start=lambda: None))
+    # Small batches so an export spans several fetches
+    monkeypatch.setattr('app.EXPORT_BATCH_SIZE', 2)
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        response = client.post('/login', data={'email': TECHNICIAN[5], 'password': 'secret'})
+        assert response.status_code == 302
+        client.connections = connections
+        yield client
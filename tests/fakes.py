@@ -0,0 +1,79 @@
+"""psycopg2 stand-ins so the app can be exercised without a database"""
+import datetime
+import types
+import psycopg2
+
+TECHNICIAN = (1, 'Asha Rao', 'plumbing', 'Pune', '555-0100', 'asha@example.com')
+EXPORT_ROWS = [
+    (datetime.date(2024, 5, day), '10:00', f'Client {day}', 'plumbing_leak', 'Leaking tap', 'Pune', '555-0199')
+    for day in range(1, 6)
+]
+
+
+class FakeCursor:
+    def __init__(self, conn, name=None):
+        self.conn = conn
+        self.name = name
+        self._rows = []
+
+    def execute(self, query, params=None):
+        if not self.conn.autocommit:
+            self.conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        if 'FROM technicians' in query:
+            # Looked up by email (login) or by id
+            self._rows = [TECHNICIAN] if set(params) & {TECHNICIAN[0], TECHNICIAN[5]} else []
+        elif 'appointment_daily_rollup' in query:
+            # compute_analytics: no appointments in the window
+            self._rows = []
+        elif 'appointment_intent_totals' in query:
+            # appointments_fingerprint: no appointments yet
+            self._rows = [(0, None, None)]
+        elif 'FROM appointments' in query and self.name:
+            self.conn.export_cursors.append(self.name)
+            self._rows = list(EXPORT_ROWS)
+        elif 'FROM appointments' in query:
+            self._rows = []
+        else:
+            self._rows = [(1,)]
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """psycopg2 connection stand-in that, like psycopg2, refuses named cursors in autocommit mode"""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.export_cursors = []
+
+    @property
+    def info(self):
+        return types.SimpleNamespace(transaction_status=self.status)
+
+    def cursor(self, name=None, **kwargs):
+        if name is not None and self.autocommit:
+            raise psycopg2.ProgrammingError("can't use a named cursor outside of transactions")
+        return FakeCursor(self, name)
+
+    def rollback(self):
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
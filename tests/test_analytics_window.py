@@ -0,0 +1,13 @@
+import pytest
+from analytics import MAX_RANGE_DAYS, InvalidWindow, resolve_window
+
+
+@pytest.mark.parametrize('range_value', ['1000000d', '999999999999w', '1000000m', f'{MAX_RANGE_DAYS + 1}d'])
+def test_oversized_range_is_invalid(range_value):
+    with pytest.raises(InvalidWindow):
+        resolve_window(range_value)
+
+
+def test_oversized_range_is_a_bad_request(client):
+    for url in ('/export/chart-data?range=1000000d', '/matplotlib-charts/daily?range=1000000m'):
+        assert client.get(url).status_code == 400
@@ -0,0 +1,20 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import charts
+
+
+def test_broken_render_pool_returns_503(client, monkeypatch):
+    def submit(*args):
+        future = Future()
+        future.set_exception(BrokenProcessPool('render process died'))
+        return future
+
+    resets = []
+    monkeypatch.setattr(charts, 'POOL_WORKERS', 1)
+    monkeypatch.setattr(charts, '_submit', submit)
+    monkeypatch.setattr(charts, '_reset_executor', lambda: resets.append(True))
+
+    response = client.get('/matplotlib-charts/daily?format=png')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert resets == [True]
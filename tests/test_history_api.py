@@ -0,0 +1,25 @@
+import psycopg2
+import app as app_module
+
+
+def test_history_api_pages_as_json(client):
+    response = client.get('/api/history')
+    assert response.status_code == 200
+    assert response.get_json() == {'appointments': [], 'next_cursor': None}
+
+
+def test_history_api_database_error_returns_503(client, monkeypatch):
+    def fail(*args):
+        raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+    monkeypatch.setattr(app_module, 'fetch_history_page', fail)
+    response = client.get('/api/history')
+    assert response.status_code == 503
+    assert 'error' in response.get_json()
+
+
+def test_history_api_open_breaker_returns_503(client, monkeypatch):
+    monkeypatch.setattr(app_module, 'get_db_connection', lambda role=None: None)
+    response = client.get('/api/history')
+    assert response.status_code == 503
+    assert 'error' in response.get_json()
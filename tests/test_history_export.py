@@ -0,0 +1,26 @@
+import gzip
+
+
+def _check_export(client, body):
+    lines = body.decode('utf-8').splitlines()
+    assert lines[0] == 'Date,Time Slot,Client Name,Issue Type,Problem Description,Location,Contact'
+    assert lines[1:] == [f'2024-05-0{day},10:00,Client {day},plumbing_leak,Leaking tap,Pune,555-0199'
+                         for day in range(1, 6)]
+    # Read through a server-side cursor; the connection is back in autocommit
+    assert [name for conn in client.connections for name in conn.export_cursors] == ['history_export']
+    assert all(conn.autocommit for conn in client.connections)
+
+
+def test_history_export_streams_csv(client):
+    response = client.get('/export/history/csv')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert response.is_streamed
+    _check_export(client, b''.join(response.response))
+
+
+def test_history_export_streams_gzip(client):
+    response = client.get('/export/history/csv?gzip=true')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    _check_export(client, gzip.decompress(b''.join(response.response)))
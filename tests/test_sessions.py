@@ -0,0 +1,86 @@
+import flask
+from flask.sessions import SecureCookieSessionInterface
+import cache
+import sessions
+from app import app
+
+
+def test_anonymous_requests_do_not_evict_signed_in_sessions(client, monkeypatch):
+    store = cache.LRUBackend(max_entries=5)
+    monkeypatch.setattr(app.session_interface, 'backend', store)
+    assert client.post('/login', data={'email': 'asha@example.com', 'password': 'secret'}).status_code == 302
+    assert len(store) == 1
+
+    # Redirected with a flash message, never followed
+    anonymous = [app.test_client() for _ in range(20)]
+    for other in anonymous:
+        assert other.get('/dashboard').status_code == 302
+    assert len(store) == 1
+    assert client.get('/profile').status_code == 200
+
+    # The flash survives the redirect in a signed cookie
+    assert 'Please login' in anonymous[0].get('/login').get_data(as_text=True)
+    assert anonymous[0].get_cookie('session') is None
+
+
+def test_login_replaces_session_id_and_logout_drops_it(client):
+    store = app.session_interface.backend
+    old_sid = client.get_cookie('session').value
+    client.post('/login', data={'email': 'asha@example.com', 'password': 'secret'})
+    sid = client.get_cookie('session').value
+    assert sid != old_sid
+    assert store.get(('session', old_sid)) is None
+
+    client.get('/logout')
+    assert store.get(('session', sid)) is None
+    assert client.get('/profile').status_code == 302
+
+
+def test_profile_uses_cached_technician(client, monkeypatch):
+    monkeypatch.setattr(sessions.models, 'get_technician', None)
+    assert 'Asha Rao' in client.get('/profile').get_data(as_text=True)
+
+
+def test_several_workers_without_a_shared_store_use_cookie_sessions():
+    def interface_for(backend, workers):
+        app = flask.Flask(__name__)
+        app.session_interface = sessions.ServerSessionInterface(backend)
+        sessions.check_store(app, workers)
+        return app.session_interface
+
+    assert isinstance(interface_for(cache.LRUBackend(), 1), sessions.ServerSessionInterface)
+    assert isinstance(interface_for(cache.SharedBackend(object()), 4), sessions.ServerSessionInterface)
+    for backend in (cache.LRUBackend(), cache.SharedBackend(cache.LocalStore())):
+        assert isinstance(interface_for(backend, 2), SecureCookieSessionInterface)
+
+
+def test_login_with_cookie_sessions(client, monkeypatch):
+    monkeypatch.setattr(app, 'session_interface', SecureCookieSessionInterface())
+    client.get('/logout')
+    assert client.post('/login', data={'email': 'asha@example.com', 'password': 'secret'}).status_code == 302
+    assert client.get('/profile').status_code == 200
+
+
+def test_clearing_a_shared_cache_removes_only_its_own_keys():
+    client = cache.LocalStore()
+    technicians = cache.ResultCache(cache.SharedBackend(client, 'portal:technician:'))
+    other = cache.SharedBackend(client, 'portal:session:')
+    technicians.set(1, 'record')
+    other.set('sid', 'session', 60)
+
+    technicians.invalidate()
+    assert technicians.get(1) is None
+    assert other.get('sid') == 'session'
+
+
+def test_technician_change_changes_page_etags(client):
+    response = client.get('/history')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert client.get('/history', headers={'If-None-Match': etag}).status_code == 304
+
+    renamed = sessions.technician_cache.get(1)._replace(name='Asha Kulkarni')
+    sessions.technician_cache.set(1, renamed)
+    response = client.get('/history', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Asha Kulkarni' in response.get_data(as_text=True)
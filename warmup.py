@@ -0,0 +1,40 @@
+import logging
+import time
+import charts
+import db
+import sessions
+
+logger = logging.getLogger(__name__)
+
+
+def preload(app):
+    """Load everything a worker would otherwise load on its first requests.
+
+    Called in the gunicorn master before it forks (see gunicorn.conf.py), so
+    workers inherit the compiled templates, and the chart stack when they
+    render charts themselves, and share those pages copy-on-write.
+    """
+    started = time.perf_counter()
+    # Render processes never inherit the master (forkserver and spawn both
+    # start from a fresh interpreter) and are warmed by after_fork instead
+    if charts.POOL_WORKERS <= 0:
+        charts.warm_up()
+    templates = app.jinja_env.list_templates()
+    for name in templates:
+        app.jinja_env.get_template(name)
+    logger.info("Preloaded %d templates in %.2fs", len(templates), time.perf_counter() - started)
+
+
+def after_fork():
+    """Per-worker start-up: open the database pools, start the chart render processes and the technician listener.
+
+    Pools and threads never cross a fork; each worker builds its own here
+    instead of on its first request.
+    """
+    started = time.perf_counter()
+    db.get_pool()
+    for replica in db.replicas:
+        db.get_pool(replica.name)
+    charts.warm_pool()
+    sessions.get_listener().start()
+    logger.info("Worker initialized in %.2fs", time.perf_counter() - started)